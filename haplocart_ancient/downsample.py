@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+import argparse
+import bisect
+import glob
+import hashlib
+import os
+import sys
+import numpy as np
+import pysam
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+MITO_NAMES = ['chrM', 'MT']
+# samtools depth skips unmapped, secondary, QC-failed and duplicate reads by default
+DEPTH_SKIP = 0x4 | 0x100 | 0x200 | 0x400
+MASK64 = (1 << 64) - 1
+
+def mito_contig(bam):
+    for name in MITO_NAMES:
+        if name in bam.references:
+            return name
+    return None
+
+def keep_depth(read):
+    return not read.flag & DEPTH_SKIP
+
+def coverage(bam, contig):
+    # Per-base depth of the aligned blocks on `contig`, as samtools depth counts it
+    diff = np.zeros(bam.get_reference_length(contig) + 1, dtype=np.int64)
+    for read in bam.fetch(contig):
+        if keep_depth(read):
+            for start, end in read.get_blocks():
+                diff[start] += 1
+                diff[end] -= 1
+    return np.cumsum(diff[:-1])
+
+def mean_depth(depth):
+    # Mean over covered positions, like samtools depth | awk '{sum+=$3} END {print sum/NR}'
+    covered = np.count_nonzero(depth)
+    return depth.sum() / covered if covered else 0.0
+
+def replicate_seed(seed, replicate):
+    # Depends on the replicate only, so every rate of a replicate draws the same value per read
+    return int.from_bytes(hashlib.blake2b(f'{seed}:{replicate}'.encode(), digest_size=8).digest(), 'little')
+
+def uniform(name_hash, seed):
+    # splitmix64 finalizer of the read-name hash mixed with the replicate seed, mapped to [0, 1)
+    z = (name_hash ^ seed) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return (z ^ (z >> 31)) / 2.0**64
+
+def rate_name(depth):
+    return f'{depth:g}x'
+
+def downsample_bam(bam_path, out_root, depths, replicates, seed, threads):
+    # Depth is computed once from the indexed mitochondrial region. The BAM is
+    # then streamed once. Each read draws one value per replicate from a hash of
+    # its name and goes to every output whose fraction exceeds that value. Rates
+    # are therefore nested within a replicate, and mates stay together.
+    bam = pysam.AlignmentFile(bam_path, 'rb', threads=threads)
+    contig = mito_contig(bam)
+    if contig is None:
+        bam.close()
+        return bam_path, None
+    depth = mean_depth(coverage(bam, contig))
+    fractions = [min(1.0, target / depth) if depth > 0 else 0.0 for target in depths]
+    seeds = [replicate_seed(seed, replicate) for replicate in replicates]
+
+    stem = os.path.basename(bam_path)[:-len('.bam')]
+    outputs, out_paths = [], []
+    for target in depths:
+        out_dir = os.path.join(out_root, rate_name(target))
+        os.makedirs(out_dir, exist_ok=True)
+        for replicate in replicates:
+            out_paths.append(os.path.join(out_dir, f'{stem}_replicate_{replicate}.bam'))
+            outputs.append(pysam.AlignmentFile(out_paths[-1] + '.tmp', 'wb', template=bam, threads=threads))
+
+    # Difference arrays of the mitochondrial depth of every output
+    contig_id = bam.get_tid(contig)
+    diffs = np.zeros((len(outputs), bam.get_reference_length(contig) + 1), dtype=np.int64)
+    # Rewind past the depth pass; until_eof iterates from the current position
+    bam.reset()
+    for read in bam.fetch(until_eof=True):
+        name_hash = int.from_bytes(hashlib.blake2b(read.query_name.encode(), digest_size=8).digest(), 'little')
+        blocks = read.get_blocks() if read.reference_id == contig_id and keep_depth(read) else []
+        for replicate_index, replicate_seed_value in enumerate(seeds):
+            # Fractions are ascending, so the read goes to this rate and every higher one
+            draw = uniform(name_hash, replicate_seed_value)
+            for rate_index in range(bisect.bisect_right(fractions, draw), len(fractions)):
+                output = rate_index * len(seeds) + replicate_index
+                outputs[output].write(read)
+                for start, end in blocks:
+                    diffs[output, start] += 1
+                    diffs[output, end] -= 1
+    bam.close()
+
+    results = []
+    for output, path in enumerate(out_paths):
+        outputs[output].close()
+        os.replace(path + '.tmp', path)
+        results.append((path, fractions[output // len(seeds)], mean_depth(np.cumsum(diffs[output, :-1]))))
+    return bam_path, (depth, results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Downsample BAMs to several mitochondrial depths and replicates in one pass per BAM.")
+    parser.add_argument("bam_dir", help="Directory containing indexed BAM files")
+    parser.add_argument("-o", "--output-dir", default="subsampled_reps", help="Outputs go to <output-dir>/<depth>x/<name>_replicate_<n>.bam")
+    parser.add_argument("--depths", type=float, nargs='+', default=[0.25, 0.5, 1, 2], help="Target mitochondrial depths")
+    parser.add_argument("--replicates", type=int, default=5, help="Replicates per depth")
+    parser.add_argument("--seed", type=int, default=1, help="Base seed; replicate seeds are derived from it")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="BAMs processed in parallel")
+    parser.add_argument("-@", "--threads", type=int, default=4, help="BGZF threads per input and output file")
+    args = parser.parse_args()
+
+    bam_paths = sorted(glob.glob(os.path.join(args.bam_dir, '*.bam')))
+    depths = sorted(args.depths)
+    replicates = list(range(1, args.replicates + 1))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(downsample_bam, path, args.output_dir, depths, replicates, args.seed, args.threads)
+                   for path in bam_paths]
+        for future in as_completed(futures):
+            bam_path, result = future.result()
+            filename = os.path.basename(bam_path)
+            if result is None:
+                print(f'Mitochondrial chromosome not found in {bam_path}', file=sys.stderr)
+                continue
+            depth, outputs = result
+            print(f'Depth of coverage of {filename} on the mitochondria is {depth:.4f}')
+            for path, fraction, subsampled_depth in outputs:
+                print(f'  {path}: fraction {fraction:.6f}, depth {subsampled_depth:.4f}')
+
+if __name__ == "__main__":
+    main()
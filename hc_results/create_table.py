@@ -1,9 +1,10 @@
 import os
+import json
+import argparse
 import pandas as pd
 import re  # Added for extracting replicate numbers
-
-# Specify the directory containing your log files
-log_dir = "."
+from concurrent.futures import ThreadPoolExecutor
+from npz_table import save_table
 
 def extract_info_from_filename(filename):
     """Extract sample name, subsampling rate, correction status, and replicate number from the filename."""
@@ -21,18 +22,72 @@ def extract_info_from_filename(filename):
     
     return sample_name, float(subsampling_rate), correction_status, replicate_number
 
-def extract_info_from_file(filepath):
-    """Extract the haplogroup and number of reads from the file content."""
-    with open(filepath, 'r') as file:
-        lines = file.readlines()
-        for line in lines:
-            if line.startswith('stdin'):
-                parts = line.strip().split()
-                haplogroup = parts[1]
-                reads = int(parts[2])
-                return haplogroup, reads
+def extract_info_from_file(filepath, block_size=4096, max_tail=1 << 20):
+    """Extract the haplogroup and number of reads from the result block at the end of the log."""
+    # Read backwards from EOF one block at a time. Only the new block, plus the
+    # few bytes of the following block a split '#sample' could reach into, is
+    # searched, and a log without the header within max_tail bytes of its end
+    # has no result block.
+    marker = b'#sample'
+    with open(filepath, 'rb') as file:
+        end = position = file.seek(0, os.SEEK_END)
+        blocks, overlap = [], b''
+        while True:
+            if position == 0 or end - position >= max_tail:
+                return None, None
+            step = min(block_size, position)
+            position -= step
+            file.seek(position)
+            blocks.append(file.read(step))
+            window = blocks[-1] + overlap
+            if marker in window:
+                break
+            overlap = window[:len(marker) - 1]
+    tail = b''.join(reversed(blocks))
+
+    for line in tail[tail.rfind(marker):].splitlines():
+        if line.startswith(b'stdin'):
+            parts = line.strip().split()
+            haplogroup = parts[1].decode()
+            reads = int(parts[2])
+            return haplogroup, reads
     return None, None
 
+def load_cache(cache_path):
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    with open(cache_path, 'r') as f:
+        return json.load(f)
+
+def save_cache(cache, cache_path):
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+
+def collect_log_results(log_dir, cache_path=None, workers=8):
+    """Map each .log file name to its (haplogroup, reads), rereading only logs whose size or mtime changed."""
+    cache = load_cache(cache_path)
+    entries = [entry for entry in os.scandir(log_dir) if entry.name.endswith('.log')]
+    results, stale = {}, []
+    for entry in entries:
+        info = entry.stat()
+        cached = cache.get(entry.name)
+        if cached and cached['size'] == info.st_size and cached['mtime_ns'] == info.st_mtime_ns:
+            results[entry.name] = (cached['haplogroup'], cached['reads'])
+        else:
+            stale.append((entry, info))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        parsed = executor.map(lambda item: extract_info_from_file(item[0].path), stale)
+        for (entry, info), (haplogroup, reads) in zip(stale, parsed):
+            results[entry.name] = (haplogroup, reads)
+            cache[entry.name] = {'size': info.st_size, 'mtime_ns': info.st_mtime_ns, 'haplogroup': haplogroup, 'reads': reads}
+
+    if cache_path:
+        save_cache({name: cache[name] for name in results}, cache_path)
+    return results
+
 # Create a dictionary mapping sample names to combined predictions
 full_coverage_predictions = {
     "DA100": "C4b1/C4b1",
@@ -57,24 +112,28 @@ full_coverage_predictions = {
     "STR486": "T2b/T2b",
 }
 
+parser = argparse.ArgumentParser(description="Collect HaploCart predictions from the .log files into a LaTeX table.")
+parser.add_argument("--log-dir", default=".", help="Directory containing the log files")
+parser.add_argument("--cache", default="log_cache.json", help="Cache of parsed logs keyed by size and mtime ('' disables it)")
+parser.add_argument("--workers", type=int, default=8, help="Threads reading log files")
+parser.add_argument("--table", default="table.npz", help="Typed table read by stats.py and dist.py")
+args = parser.parse_args()
+
 data = []
 
 # Iterate through all log files in the specified directory
-for filename in os.listdir(log_dir):
-    if filename.endswith('.log'):
-        sample_name, subsampling_rate, correction_status, replicate_number = extract_info_from_filename(filename)
-        filepath = os.path.join(log_dir, filename)
-        haplogroup, reads = extract_info_from_file(filepath)
-
-        data.append({
-            'Sample Name': sample_name,
-            'Subsampling Rate': subsampling_rate,
-            'Correction Status': correction_status,
-            'Haplogroup': haplogroup,
-            'Reads': reads,
-            'Replicate': replicate_number,
-            'Full Coverage Prediction': full_coverage_predictions.get(sample_name, "N/A")
-        })
+for filename, (haplogroup, reads) in collect_log_results(args.log_dir, args.cache, args.workers).items():
+    sample_name, subsampling_rate, correction_status, replicate_number = extract_info_from_filename(filename)
+
+    data.append({
+        'Sample Name': sample_name,
+        'Subsampling Rate': subsampling_rate,
+        'Correction Status': correction_status,
+        'Haplogroup': haplogroup,
+        'Reads': reads,
+        'Replicate': replicate_number,
+        'Full Coverage Prediction': full_coverage_predictions.get(sample_name, "N/A")
+    })
 
 # Create a DataFrame from the data
 df = pd.DataFrame(data)
@@ -105,11 +164,14 @@ pivot_df.rename(columns={
 # Sort the DataFrame by subsampling rate
 pivot_df = pivot_df.sort_values(by=['Rate', 'Sample Name', 'Replicate'])
 
+# Save the typed table for stats.py and dist.py; the LaTeX file is only for rendering
+save_table(pivot_df, args.table)
+
 # Save the DataFrame to a LaTeX file
 with open('table.txt', 'w') as f:
     latex_string = pivot_df.to_latex(index=False, na_rep='N/A', longtable=True)
     latex_string += '\n\\caption{This is the caption for the table.}'
     f.write(latex_string)
 
-print("Data aggregation complete. The data has been saved to 'table.txt'.")
+print(f"Data aggregation complete. The data has been saved to 'table.txt' and '{args.table}'.")
 
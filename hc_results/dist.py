@@ -1,6 +1,20 @@
+import os
+import json
+import mmap
+import argparse
+import numpy as np
 import pandas as pd
 import gzip
-from Levenshtein import distance as levenshtein_distance
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from Levenshtein import distance as levenshtein_distance, editops
+from npz_table import load_table
+
+# A/C/G/T -> 0..3; any other character is kept as an exception
+BASE_CODES = np.full(256, 255, dtype=np.uint8)
+for code, base in enumerate(b'ACGT'):
+    BASE_CODES[base] = code
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
 
 # Function to read a zipped FASTA file and return the consensus sequence
 def read_fasta(file_path):
@@ -10,35 +24,251 @@ def read_fasta(file_path):
         sequence = ''.join(line.strip() for line in lines if not line.startswith('>'))
         return sequence
 
-# Function to calculate mean edit distances for uncorrected and corrected sequences
-def calculate_mean_edit_distance(table_path, fasta_dir):
-    # Read the table
+def clean_name(haplogroup):
+    return haplogroup.replace(" ", "").replace("\t", "")
+
+# Pack a sequence at 4 bases per byte; non-ACGT characters are stored separately as (positions, characters)
+def pack_sequence(sequence):
+    raw = np.frombuffer(sequence.encode(), dtype=np.uint8)
+    codes = BASE_CODES[raw]
+    exceptions = np.flatnonzero(codes == 255)
+    codes = np.where(codes == 255, 0, codes)
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    quads = padded.reshape(-1, 4)
+    packed = quads[:, 0] << 6 | quads[:, 1] << 4 | quads[:, 2] << 2 | quads[:, 3]
+    return {'packed': packed.tobytes(), 'length': len(codes),
+            'exception_positions': exceptions.tolist(), 'exception_bases': raw[exceptions].tobytes().decode()}
+
+def unpack_sequence(entry):
+    packed = np.frombuffer(entry['packed'], dtype=np.uint8)
+    codes = np.stack([packed >> 6, packed >> 4 & 3, packed >> 2 & 3, packed & 3], axis=1).ravel()[:entry['length']]
+    raw = BASES[codes]
+    raw[np.array(entry['exception_positions'], dtype=np.int64)] = np.frombuffer(entry['exception_bases'].encode(), dtype=np.uint8)
+    return raw.tobytes().decode()
+
+# Single-file archive: an 8-byte header length, a JSON index of
+# haplogroup -> offset/size/length/exceptions, then the packed bytes
+def build_archive(fasta_dir, archive_path):
+    index, blobs, offset = {}, [], 0
+    for file_name in sorted(os.listdir(fasta_dir)):
+        if not file_name.endswith('.fasta.gz'):
+            continue
+        entry = pack_sequence(read_fasta(os.path.join(fasta_dir, file_name)))
+        packed = entry.pop('packed')
+        index[file_name[:-len('.fasta.gz')]] = dict(entry, offset=offset, size=len(packed))
+        blobs.append(packed)
+        offset += len(packed)
+    header = json.dumps(index).encode()
+    with open(archive_path + '.tmp', 'wb') as f:
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for packed in blobs:
+            f.write(packed)
+    os.replace(archive_path + '.tmp', archive_path)
+    return len(index)
+
+class HaplogroupStore:
+    """Haplogroup -> sequence. Each FASTA (or archive entry) is decoded once and
+    kept 2-bit packed; the most recently used unpacked sequences are cached."""
+
+    def __init__(self, fasta_dir, archive_path=None, cache_size=64):
+        self.fasta_dir = fasta_dir
+        self.cache_size = cache_size
+        self.packed = {}
+        self.sequences = OrderedDict()
+        self.index, self.archive = {}, None
+        if archive_path:
+            with open(archive_path, 'rb') as f:
+                header_length = int.from_bytes(f.read(8), 'little')
+                self.index = json.loads(f.read(header_length))
+                self.archive = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data_start = 8 + header_length
+
+    def load_packed(self, haplogroup):
+        if haplogroup not in self.packed:
+            if haplogroup in self.index:
+                entry = dict(self.index[haplogroup])
+                start = self.data_start + entry['offset']
+                entry['packed'] = self.archive[start:start + entry['size']]
+                self.packed[haplogroup] = entry
+            else:
+                self.packed[haplogroup] = pack_sequence(read_fasta(os.path.join(self.fasta_dir, f"{haplogroup}.fasta.gz")))
+        return self.packed[haplogroup]
+
+    def __getitem__(self, haplogroup):
+        haplogroup = clean_name(haplogroup)
+        if haplogroup in self.sequences:
+            self.sequences.move_to_end(haplogroup)
+            return self.sequences[haplogroup]
+        sequence = unpack_sequence(self.load_packed(haplogroup))
+        self.sequences[haplogroup] = sequence
+        if len(self.sequences) > self.cache_size:
+            self.sequences.popitem(last=False)
+        return sequence
+
+# Ground truth, corrected and uncorrected haplogroup of every table row
+def load_haplogroups(table_path):
+    if table_path.endswith('.npz'):
+        df = load_table(table_path)
+        # The full-coverage prediction is stored as 'corrected/uncorrected'; the first one is the ground truth
+        ground_truth = df['Full_Coverage_Prediction'].str.split('/').str[0]
+        return ground_truth.tolist(), df['HG_corrected'].tolist(), df['HG_uncorrected'].tolist()
+
+    # Plain-text rows of the LaTeX table
     df = pd.read_csv(table_path, sep=' & ', engine='python', header=None)
-    
-    # Extract relevant columns
-    ground_truth_haplogroups = df[2].tolist()
-    corrected_haplogroups = df[4].tolist()
-    uncorrected_haplogroups = df[5].tolist()
-
-    edit_distances_uncorrected = []
-    edit_distances_corrected = []
-    for ground_truth, corrected, uncorrected in zip(ground_truth_haplogroups, corrected_haplogroups, uncorrected_haplogroups):
-        # Construct file paths and sanitize them
-        ground_truth_path = f"{fasta_dir}/{ground_truth}.fasta.gz".replace(" ", "").replace("\t", "")
-        corrected_path = f"{fasta_dir}/{corrected}.fasta.gz".replace(" ", "").replace("\t", "")
-        uncorrected_path = f"{fasta_dir}/{uncorrected}.fasta.gz".replace(" ", "").replace("\t", "")
-
-        # Read the consensus sequences
-        ground_truth_seq = read_fasta(ground_truth_path)
-        corrected_seq = read_fasta(corrected_path)
-        uncorrected_seq = read_fasta(uncorrected_path)
-
-        # Calculate and store the edit distances
-        distance_uncorrected = levenshtein_distance(ground_truth_seq, uncorrected_seq)
-        distance_corrected = levenshtein_distance(ground_truth_seq, corrected_seq)
-
-        edit_distances_uncorrected.append(distance_uncorrected)
-        edit_distances_corrected.append(distance_corrected)
+    return df[2].tolist(), df[4].tolist(), df[5].tolist()
+
+# On-disk memo of pair distances. Levenshtein distance is symmetric, so a pair
+# is keyed by its two names in sorted order. Each entry is [distance, exact]:
+# exact is false when a capped run only established distance > cap, in which
+# case distance is cap + 1.
+def pair_key(first, second):
+    return '\t'.join(sorted((first, second)))
+
+def load_memo(memo_path):
+    if not memo_path or not os.path.exists(memo_path):
+        return {}
+    with open(memo_path, 'r') as f:
+        return json.load(f)
+
+def save_memo(memo, memo_path):
+    tmp_path = memo_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(memo, f)
+    os.replace(tmp_path, memo_path)
+
+def memo_lookup(memo, key, max_distance):
+    entry = memo.get(key)
+    if entry is None:
+        return None
+    distance, exact = entry
+    if exact:
+        return distance if max_distance is None else min(distance, max_distance + 1)
+    # A lower bound answers only requests capped at or below the cap it was computed with
+    if max_distance is not None and max_distance + 1 <= distance:
+        return max_distance + 1
+    return None
+
+worker_store = None
+
+def init_distance_worker(fasta_dir, archive_path):
+    global worker_store
+    worker_store = HaplogroupStore(fasta_dir, archive_path)
+
+def pair_distance(pair, max_distance):
+    first, second = pair
+    if max_distance is None:
+        return levenshtein_distance(worker_store[first], worker_store[second])
+    # With a cutoff the distance is computed in a band and returns max_distance + 1 beyond it
+    return levenshtein_distance(worker_store[first], worker_store[second], score_cutoff=max_distance)
+
+# Distance for every (truth, predicted) pair: identical names are 0, known
+# pairs come from the memo, and the remaining unique pairs run in a process pool
+def compute_pair_distances(pairs, fasta_dir, archive_path=None, memo_path=None, workers=None, max_distance=None):
+    memo = load_memo(memo_path)
+    distances, pending = {}, []
+    for first, second in set((clean_name(a), clean_name(b)) for a, b in pairs):
+        if first == second:
+            distances[first, second] = 0
+            continue
+        known = memo_lookup(memo, pair_key(first, second), max_distance)
+        if known is None:
+            pending.append((first, second))
+        else:
+            distances[first, second] = known
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_distance_worker, initargs=(fasta_dir, archive_path)) as executor:
+            for pair, distance in zip(pending, executor.map(pair_distance, pending, [max_distance] * len(pending), chunksize=4)):
+                distances[pair] = distance
+                exact = max_distance is None or distance <= max_distance
+                previous = memo.get(pair_key(*pair))
+                if exact or previous is None or (not previous[1] and previous[0] < distance):
+                    memo[pair_key(*pair)] = [distance, exact]
+        if memo_path:
+            save_memo(memo, memo_path)
+
+    print(f"{len(distances)} unique pairs, {len(pending)} computed")
+    return {(a, b): distances[clean_name(a), clean_name(b)] for a, b in pairs}
+
+# Variant sets relative to rCRS. Each variant is one int64 key,
+# (reference position << 10) | (insertion rank << 4) | allele, where rank 0 is
+# a substitution or deletion and ranks 1.. are bases inserted before that
+# position. Sorted keys make a pair distance a linear merge.
+VARIANT_ALLELES = 'ACGTNRYKMSWBDHV'
+DELETION = 15
+
+def read_reference(path):
+    if path.endswith('.gz'):
+        return read_fasta(path)
+    with open(path, 'r') as f:
+        return ''.join(line.strip() for line in f if not line.startswith('>'))
+
+def variant_key(position, rank, allele):
+    return position << 10 | rank << 4 | allele
+
+def call_variants(reference, sequence):
+    keys, inserted = [], {}
+    for operation, reference_position, sequence_position in editops(reference, sequence):
+        if operation == 'delete':
+            keys.append(variant_key(reference_position, 0, DELETION))
+            continue
+        allele = VARIANT_ALLELES.find(sequence[sequence_position].upper())
+        allele = allele if allele >= 0 else VARIANT_ALLELES.index('N')
+        if operation == 'replace':
+            keys.append(variant_key(reference_position, 0, allele))
+        else:
+            inserted[reference_position] = inserted.get(reference_position, 0) + 1
+            keys.append(variant_key(reference_position, inserted[reference_position], allele))
+    return np.array(sorted(keys), dtype=np.int64)
+
+def build_variant_table(fasta_dir, reference_path, variants_path, archive_path=None):
+    # One sorted variant array per haplogroup, saved together in an .npz
+    reference = read_reference(reference_path)
+    store = HaplogroupStore(fasta_dir, archive_path, cache_size=1)
+    names = sorted(store.index) if store.index else sorted(name[:-len('.fasta.gz')] for name in os.listdir(fasta_dir) if name.endswith('.fasta.gz'))
+    variants = {name: call_variants(reference, store[name]) for name in names}
+    np.savez(variants_path, **variants)
+    return len(variants)
+
+def variant_distance(first, second):
+    # Size of the symmetric difference of two sorted key arrays
+    i = j = shared = 0
+    while i < len(first) and j < len(second):
+        if first[i] == second[j]:
+            shared += 1
+            i += 1
+            j += 1
+        elif first[i] < second[j]:
+            i += 1
+        else:
+            j += 1
+    return len(first) + len(second) - 2 * shared
+
+def compute_variant_distances(pairs, variants_path):
+    with np.load(variants_path, allow_pickle=False) as data:
+        variants = {}
+        distances = {}
+        for first, second in set((clean_name(a), clean_name(b)) for a, b in pairs):
+            for name in (first, second):
+                if name not in variants:
+                    variants[name] = data[name].tolist()
+            distances[first, second] = variant_distance(variants[first], variants[second])
+    return {(a, b): distances[clean_name(a), clean_name(b)] for a, b in pairs}
+
+# Function to calculate mean edit distances for uncorrected and corrected sequences
+def calculate_mean_edit_distance(table_path, fasta_dir, archive_path=None, memo_path=None, workers=None, max_distance=None, variants_path=None):
+    ground_truth_haplogroups, corrected_haplogroups, uncorrected_haplogroups = load_haplogroups(table_path)
+    pairs = list(zip(ground_truth_haplogroups, corrected_haplogroups)) + list(zip(ground_truth_haplogroups, uncorrected_haplogroups))
+    if variants_path:
+        distances = compute_variant_distances(pairs, variants_path)
+    else:
+        distances = compute_pair_distances(pairs, fasta_dir, archive_path, memo_path, workers, max_distance)
+
+    # Calculate and store the edit distances
+    edit_distances_uncorrected = [distances[pair] for pair in zip(ground_truth_haplogroups, uncorrected_haplogroups)]
+    edit_distances_corrected = [distances[pair] for pair in zip(ground_truth_haplogroups, corrected_haplogroups)]
 
     # Calculate means
     mean_distance_uncorrected = pd.Series(edit_distances_uncorrected).mean()
@@ -46,10 +276,28 @@ def calculate_mean_edit_distance(table_path, fasta_dir):
 
     return mean_distance_uncorrected, mean_distance_corrected
 
-# Example usage
-table_path = 'raw_table.txt'
-fasta_dir = '/home/projects/mito_haplotype/vgan/data/synthetic_fastas'
-mean_distance_uncorrected, mean_distance_corrected = calculate_mean_edit_distance(table_path, fasta_dir)
-print(f"mean Edit Distance (Uncorrected vs Ground Truth): {mean_distance_uncorrected}")
-print(f"mean Edit Distance (Corrected vs Ground Truth): {mean_distance_corrected}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mean edit distance between predicted and ground-truth haplogroup sequences.")
+    parser.add_argument("--table", default='table.npz' if os.path.exists('table.npz') else 'raw_table.txt', help="table.npz from create_table.py, or raw_table.txt")
+    parser.add_argument("--fasta-dir", default='/home/projects/mito_haplotype/vgan/data/synthetic_fastas', help="Directory of <haplogroup>.fasta.gz files")
+    parser.add_argument("--archive", default=None, help="Packed archive of the FASTA directory, read instead of the .fasta.gz files")
+    parser.add_argument("--build-archive", action="store_true", help="(Re)build --archive from --fasta-dir first")
+    parser.add_argument("--memo", default="distance_memo.json", help="On-disk memo of pair distances ('' disables it)")
+    parser.add_argument("--workers", type=int, default=None, help="Processes computing distances")
+    parser.add_argument("--max-distance", type=int, default=None, help="Cap distances at this value (banded computation); larger ones count as max + 1")
+    parser.add_argument("--variants", default=None, help="Variant table (.npz); distances become variant-set differences relative to rCRS")
+    parser.add_argument("--build-variants", default=None, metavar="RCRS_FASTA", help="(Re)build --variants against this rCRS FASTA first")
+    args = parser.parse_args()
 
+    if args.build_archive:
+        if not args.archive:
+            parser.error("--build-archive needs --archive")
+        print(f"Packed {build_archive(args.fasta_dir, args.archive)} haplogroups into {args.archive}")
+    if args.build_variants:
+        if not args.variants:
+            parser.error("--build-variants needs --variants")
+        print(f"Called variants for {build_variant_table(args.fasta_dir, args.build_variants, args.variants, args.archive)} haplogroups into {args.variants}")
+    mean_distance_uncorrected, mean_distance_corrected = calculate_mean_edit_distance(args.table, args.fasta_dir, args.archive,
+                                                                                     args.memo, args.workers, args.max_distance, args.variants)
+    print(f"mean Edit Distance (Uncorrected vs Ground Truth): {mean_distance_uncorrected}")
+    print(f"mean Edit Distance (Corrected vs Ground Truth): {mean_distance_corrected}")
@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+
+# Typed tables as .npz: one array per column plus the column order in
+# __columns__. Strings become fixed-width unicode, so no pickling is needed.
+
+def save_table(frame, path):
+    arrays = {}
+    for column in frame.columns:
+        values = frame[column]
+        if values.dtype == object or pd.api.types.is_string_dtype(values):
+            arrays[column] = values.fillna('').astype(str).to_numpy(dtype=str)
+        else:
+            arrays[column] = values.to_numpy()
+    np.savez(path, __columns__=np.array(list(frame.columns), dtype=str), **arrays)
+
+def load_table(path):
+    with np.load(path, allow_pickle=False) as data:
+        return pd.DataFrame({str(column): data[column] for column in data['__columns__']})
@@ -1,5 +1,8 @@
+import os
+import argparse
 import pandas as pd
 from io import StringIO
+from npz_table import load_table
 
 pd.set_option('display.max_rows', None)
 
@@ -15,25 +18,31 @@ def process_latex_data_for_pandas(latex_table):
     csv_table = '\n'.join(processed_lines)
     return csv_table
 
-# Replace 'file_path' with the path to your LaTeX table file
-file_path = 'table.txt'
-
-with open(file_path, 'r') as file:
-    full_latex_table = file.read()
-
-csv_table_improved = process_latex_data_for_pandas(full_latex_table)
-df_full_improved = pd.read_csv(StringIO(csv_table_improved))
-# Convert to numeric, coerce non-numeric to NaN
-df_full_improved['Reads_corrected'] = pd.to_numeric(df_full_improved['Reads_corrected'], errors='coerce')
-df_full_improved['Reads_uncorrected'] = pd.to_numeric(df_full_improved['Reads_uncorrected'], errors='coerce')
-
-# Assuming 'Reads_corrected' is the 7th column and 'Reads_uncorrected' is the 8th column
-# Adjust the indices as needed based on your actual data
-mean_corrected = df_full_improved.iloc[1:, 6].dropna().mean()  # Start from the second row
-mean_uncorrected = df_full_improved.iloc[1:, 7].dropna().mean()  # Start from the second row
-
-print(f"mean Reads Corrected: {mean_corrected}")
-print(f"mean Reads Uncorrected: {mean_uncorrected}")
-
-# Further processing and analysis can be done on df_full_improved as needed
-
+def load_latex_table(path):
+    # Fallback for tables that only exist as LaTeX
+    with open(path, 'r') as file:
+        full_latex_table = file.read()
+    csv_table_improved = process_latex_data_for_pandas(full_latex_table)
+    df_full_improved = pd.read_csv(StringIO(csv_table_improved))
+    # The repeated longtable header becomes a non-numeric row; drop it
+    df_full_improved = df_full_improved[df_full_improved['Sample Name'] != 'Sample Name']
+    # Convert to numeric, coerce non-numeric to NaN
+    df_full_improved['Reads_corrected'] = pd.to_numeric(df_full_improved['Reads_corrected'], errors='coerce')
+    df_full_improved['Reads_uncorrected'] = pd.to_numeric(df_full_improved['Reads_uncorrected'], errors='coerce')
+    return df_full_improved.reset_index(drop=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mean number of reads used by HaploCart with and without correction.")
+    parser.add_argument("--table", default="table.npz", help="Typed table from create_table.py")
+    parser.add_argument("--latex", default="table.txt", help="LaTeX table, used if --table does not exist")
+    args = parser.parse_args()
+
+    df_full_improved = load_table(args.table) if os.path.exists(args.table) else load_latex_table(args.latex)
+
+    mean_corrected = df_full_improved['Reads_corrected'].dropna().mean()
+    mean_uncorrected = df_full_improved['Reads_uncorrected'].dropna().mean()
+
+    print(f"mean Reads Corrected: {mean_corrected}")
+    print(f"mean Reads Uncorrected: {mean_uncorrected}")
+
+    # Further processing and analysis can be done on df_full_improved as needed
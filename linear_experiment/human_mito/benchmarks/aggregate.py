@@ -1,41 +1,148 @@
 import pandas as pd
+import numpy as np
+import gzip
 import os
+import re
+import argparse
 
-# Directory containing the TSV files
-directory = "/home/projects/MAAG/Magpie/Magpie/linear_experiment/human_mito/benchmarks"
-
-# Lists to store dataframes for each category
-safari_dfs = []
-giraffe_dfs = []
+# Benchmark files are named {aligner}_{sample}.tsv, e.g. giraffe_numtS_and_gen_0_n4000_ddhigh_s0.1.tsv
+BENCHMARK_NAME = re.compile(r'^(?P<aligner>[^_]+)_(?P<sample>.*_n(?P<nfrags>\d+)_d(?P<damage>[^_]+)_s(?P<rate>[\d.]+))\.tsv$')
 
 # List of critical metrics
 important_metrics = ['s', 'max_rss', 'mean_load']
 
-# Iterate over each TSV file and read into a DataFrame
-for filename in os.listdir(directory):
-    path = os.path.join(directory, filename)
-    if filename.endswith(".tsv"):
-        df = pd.read_csv(path, sep='\t')[important_metrics]  # Filter by important metrics
-        if "safari" in filename:
-            safari_dfs.append(df)
-        elif "giraffe" in filename:
-            giraffe_dfs.append(df)
-
-# Aggregate the dataframes for each category (assuming you want mean values)
-safari_aggregated = pd.concat(safari_dfs, ignore_index=True).mean()
-giraffe_aggregated = pd.concat(giraffe_dfs, ignore_index=True).mean()
-
-# Prepare a DataFrame for LaTeX conversion
-combined_df = pd.DataFrame({
-    "Metrics": safari_aggregated.index,
-    "Safari": safari_aggregated.values,
-    "Giraffe": giraffe_aggregated.values
-})
-
-# Convert to LaTeX with a suitable caption and save to a file
-latex_code = combined_df.to_latex(index=False, 
-                                  caption="Comparison of key performance metrics between Safari and Giraffe.", 
-                                  label="tab:key_metrics_comparison")
-with open(os.path.join(directory, "key_metrics_comparison_table.tex"), "w") as f:
-    f.write(latex_code)
+def load_benchmarks(directory):
+    # One row per benchmark run with the strata parsed from the file name
+    frames = []
+    for filename in sorted(os.listdir(directory)):
+        match = BENCHMARK_NAME.match(filename)
+        if match is None:
+            continue
+        df = pd.read_csv(os.path.join(directory, filename), sep='\t')
+        df['run'] = range(len(df))
+        df['aligner'] = match.group('aligner')
+        df['sample'] = match.group('sample')
+        df['damage'] = match.group('damage')
+        df['nfrags'] = int(match.group('nfrags'))
+        df['rate'] = float(match.group('rate'))
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+def count_fastq_reads(path):
+    with gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb') as f:
+        lines = sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b''))
+    return lines // 4
+
+def stat_reads(path):
+    # Every read of the input ends up as exactly one of TP/FP/TN/FN
+    total = 0
+    with open(path) as f:
+        for line in f:
+            if re.match(r'(True|False) (Positives|Negatives) \((TP|FP|TN|FN)\):', line):
+                total += int(line.rsplit(':', 1)[1])
+    return total
+
+def input_reads(samples, aligners, fastq_pattern, alignments_dir):
+    # Reads per (sample, aligner): from the simulation FASTQ when it exists
+    # (same for every aligner), otherwise from that aligner's .stat file
+    fastq_counts = {}
+    reads = {}
+    for sample, aligner in zip(samples, aligners):
+        if (sample, aligner) in reads:
+            continue
+        fastq_path = fastq_pattern.format(sample=sample)
+        if os.path.exists(fastq_path):
+            if sample not in fastq_counts:
+                fastq_counts[sample] = count_fastq_reads(fastq_path)
+            reads[sample, aligner] = fastq_counts[sample]
+            continue
+        stat_path = os.path.join(alignments_dir, f'{sample}_{aligner}.stat')
+        reads[sample, aligner] = stat_reads(stat_path) if os.path.exists(stat_path) else np.nan
+    return reads
+
+def add_throughput(df, reads):
+    df['reads'] = [reads[sample, aligner] for sample, aligner in zip(df['sample'], df['aligner'])]
+    # mean_load is the average CPU utilisation in percent, so CPU seconds are s * mean_load / 100;
+    # runs recorded with a load of 0 have no usable CPU time
+    df['cpu_s'] = (df['s'] * df['mean_load'] / 100).where(df['mean_load'] > 0)
+    df['reads_per_s'] = df['reads'] / df['s']
+    df['reads_per_cpu_s'] = df['reads'] / df['cpu_s']
+    df['reads_per_mb_rss'] = df['reads'] / df['max_rss']
+    return df
+
+def stratified_report(df):
+    # Median over repeated runs for every aligner and stratum
+    columns = ['reads', 's', 'cpu_s', 'max_rss', 'reads_per_s', 'reads_per_cpu_s', 'reads_per_mb_rss']
+    return df.groupby(['aligner', 'damage', 'nfrags', 'rate'])[columns].median().reset_index()
+
+def scaling_exponents(report):
+    # Slope of log(time) and log(RSS) against log(reads) across subsampling
+    # rates: ~1 means linear scaling, below 1 means fixed costs dominate
+    rows = []
+    for (aligner, damage, nfrags), group in report.groupby(['aligner', 'damage', 'nfrags']):
+        group = group.dropna(subset=['reads'])
+        if len(group) < 2:
+            continue
+        log_reads = np.log(group['reads'])
+        rows.append({'aligner': aligner, 'damage': damage, 'nfrags': nfrags, 'rates': len(group),
+                     'time_exponent': np.polyfit(log_reads, np.log(group['s']), 1)[0],
+                     'rss_exponent': np.polyfit(log_reads, np.log(group['max_rss']), 1)[0]})
+    return pd.DataFrame(rows)
+
+def plot_scaling(report, output_path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    metrics = [('reads_per_s', 'reads / s'), ('reads_per_cpu_s', 'reads / CPU s'), ('reads_per_mb_rss', 'reads / MB RSS')]
+    fig, axs = plt.subplots(1, len(metrics), figsize=(6 * len(metrics), 5))
+    for ax, (metric, label) in zip(axs, metrics):
+        for (aligner, damage), group in report.groupby(['aligner', 'damage']):
+            group = group.sort_values('rate')
+            ax.plot(group['rate'], group[metric], marker='o', label=f'{aligner} {damage}')
+        ax.set_xlabel('Subsampling rate')
+        ax.set_ylabel(label)
+    axs[-1].legend(fontsize='small')
+    fig.tight_layout()
+    plt.savefig(output_path)
+
+def write_key_metrics_table(df, directory):
+    safari_aggregated = df[df['aligner'] == 'safari'][important_metrics].mean()
+    giraffe_aggregated = df[df['aligner'] == 'giraffe'][important_metrics].mean()
+
+    # Prepare a DataFrame for LaTeX conversion
+    combined_df = pd.DataFrame({
+        "Metrics": safari_aggregated.index,
+        "Safari": safari_aggregated.values,
+        "Giraffe": giraffe_aggregated.values
+    })
+
+    # Convert to LaTeX with a suitable caption and save to a file
+    latex_code = combined_df.to_latex(index=False,
+                                      caption="Comparison of key performance metrics between Safari and Giraffe.",
+                                      label="tab:key_metrics_comparison")
+    with open(os.path.join(directory, "key_metrics_comparison_table.tex"), "w") as f:
+        f.write(latex_code)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate Snakemake benchmark TSVs per aligner and stratum.")
+    # Directory containing the TSV files
+    parser.add_argument("--directory", default="/home/projects/MAAG/Magpie/Magpie/linear_experiment/human_mito/benchmarks", help="Directory with the benchmark TSVs")
+    parser.add_argument("--fastq-pattern", default="../simulations/{sample}.fq.gz", help="Input FASTQ of a benchmark sample, used for read counts")
+    parser.add_argument("--alignments", default="../alignments", help="Directory with .stat files, used for read counts when the FASTQ is missing")
+    parser.add_argument("--output", default="throughput_by_stratum.tsv", help="Stratified throughput table")
+    parser.add_argument("--scaling", default="scaling_exponents.tsv", help="Per aligner/damage scaling exponents against input size")
+    parser.add_argument("--plot", default="throughput_scaling.png", help="Throughput against subsampling rate")
+    parser.add_argument("--no-latex", action="store_true", help="Skip the Safari/Giraffe key metrics LaTeX table (key_metrics_comparison_table.tex)")
+    args = parser.parse_args()
+
+    df = load_benchmarks(args.directory)
+    df = add_throughput(df, input_reads(df['sample'], df['aligner'], args.fastq_pattern, args.alignments))
+    report = stratified_report(df)
+    report.to_csv(args.output, sep='\t', index=False)
+    scaling_exponents(report).to_csv(args.scaling, sep='\t', index=False)
+    plot_scaling(report, args.plot)
+    print(report.groupby('aligner')[['reads_per_s', 'reads_per_cpu_s', 'reads_per_mb_rss']].median().to_string())
 
+    if not args.no_latex:
+        write_key_metrics_table(df, args.directory)
@@ -0,0 +1,224 @@
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+
+# Metrics reported per trial, in the units of the Snakemake benchmark TSVs
+# (seconds, MB); cpu_time is user + system seconds of the whole process tree
+METRICS = ['s', 'cpu_time', 'max_rss', 'max_vms', 'io_in', 'io_out', 'mean_load']
+PAGE_MB = os.sysconf('SC_PAGE_SIZE') / 2**20
+
+def process_tree(root_pid):
+    # PIDs of root_pid and all of its descendants, from /proc/<pid>/stat
+    children = {}
+    for stat_path in glob.glob('/proc/[0-9]*/stat'):
+        try:
+            with open(stat_path) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat_path.split('/')[2]))
+    tree, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+def sample_process(pid):
+    # (rss MB, vms MB, read MB, written MB) of one process, or None if it is gone
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            vms_pages, rss_pages = (int(x) for x in f.read().split()[:2])
+        io = {}
+        try:
+            with open(f'/proc/{pid}/io') as f:
+                for line in f:
+                    key, value = line.split(':')
+                    io[key] = int(value)
+        except OSError:
+            pass
+    except OSError:
+        return None
+    return rss_pages * PAGE_MB, vms_pages * PAGE_MB, io.get('read_bytes', 0) / 2**20, io.get('write_bytes', 0) / 2**20
+
+class ResourceSampler(threading.Thread):
+    # Polls the process tree of a running command every `interval` seconds and
+    # keeps the peak summed RSS/VMS and the last I/O counters seen per process
+    def __init__(self, pid, interval):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.max_rss = self.max_vms = 0.0
+        self.io = {}
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = vms = 0.0
+            for pid in process_tree(self.pid):
+                sample = sample_process(pid)
+                if sample is None:
+                    continue
+                rss += sample[0]
+                vms += sample[1]
+                self.io[pid] = sample[2:]
+            self.max_rss = max(self.max_rss, rss)
+            self.max_vms = max(self.max_vms, vms)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def run_trial(command, interval):
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.DEVNULL)
+    sampler = ResourceSampler(process.pid, interval)
+    sampler.start()
+    returncode = process.wait()
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu_time = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return {
+        's': elapsed,
+        'cpu_time': cpu_time,
+        'max_rss': sampler.max_rss,
+        'max_vms': sampler.max_vms,
+        'io_in': sum(io[0] for io in sampler.io.values()),
+        'io_out': sum(io[1] for io in sampler.io.values()),
+        'mean_load': 100 * cpu_time / elapsed if elapsed > 0 else 0.0,
+        'returncode': returncode,
+    }
+
+def input_name(path):
+    name = os.path.basename(path)
+    for suffix in ('.gz', '.fq', '.fastq', '.fa', '.fasta', '.bam'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+def run_benchmarks(label, command_template, inputs, trials, interval, history_path):
+    # Trials are interleaved across inputs so that slow drift of the machine
+    # does not fall on a single input
+    records = []
+    for trial in range(trials):
+        for path in inputs:
+            command = command_template.format(input=path, name=input_name(path), trial=trial)
+            result = run_trial(command, interval)
+            record = dict(result, label=label, input=input_name(path), trial=trial, command=command, time=time.time())
+            records.append(record)
+            with open(history_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+            status = '' if result['returncode'] == 0 else f' (exit {result["returncode"]})'
+            print(f'[{trial + 1}/{trials}] {record["input"]}: {result["s"]:.2f} s, {result["max_rss"]:.1f} MB{status}', file=sys.stderr)
+    return records
+
+def load_history(history_path, label=None):
+    records = []
+    if os.path.exists(history_path):
+        with open(history_path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    return [record for record in records if label is None or record['label'] == label]
+
+def bootstrap_ci(values, confidence=0.95, resamples=2000, seed=0):
+    # Percentile bootstrap interval of the median
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return float(values[0]), float(values[0])
+    rng = np.random.default_rng(seed)
+    medians = np.median(rng.choice(values, size=(resamples, len(values))), axis=1)
+    tail = (1 - confidence) / 2 * 100
+    return float(np.percentile(medians, tail)), float(np.percentile(medians, 100 - tail))
+
+def summarize(records, metrics=METRICS):
+    # {(label, input): {metric: {median, low, high, n}}} over successful trials
+    groups = {}
+    for record in records:
+        if record.get('returncode', 0) == 0:
+            groups.setdefault((record['label'], record['input']), []).append(record)
+    summary = {}
+    for key, group in sorted(groups.items()):
+        summary[key] = {}
+        for metric in metrics:
+            values = [record[metric] for record in group]
+            low, high = bootstrap_ci(values)
+            summary[key][metric] = {'median': float(np.median(values)), 'low': low, 'high': high, 'n': len(values)}
+    return summary
+
+def print_summary(summary, metrics=('s', 'cpu_time', 'max_rss', 'mean_load')):
+    print('\t'.join(['label', 'input'] + [f'{metric} median [95% CI]' for metric in metrics]))
+    for (label, name), values in summary.items():
+        cells = [f"{values[m]['median']:.3f} [{values[m]['low']:.3f}, {values[m]['high']:.3f}]" for m in metrics]
+        print('\t'.join([label, name] + cells))
+
+def save_baseline(summary, baseline_path):
+    baseline = {f'{label}\t{name}': {metric: values['median'] for metric, values in metrics.items()}
+                for (label, name), metrics in summary.items()}
+    with open(baseline_path + '.tmp', 'w') as f:
+        json.dump(baseline, f, indent=1)
+    os.replace(baseline_path + '.tmp', baseline_path)
+
+def find_regressions(summary, baseline_path, tolerance, metrics=('s', 'cpu_time', 'max_rss')):
+    # A metric regresses when its median exceeds the baseline by more than
+    # `tolerance` (relative) and the whole confidence interval lies above the baseline
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for (label, name), values in summary.items():
+        reference = baseline.get(f'{label}\t{name}')
+        if reference is None:
+            continue
+        for metric in metrics:
+            if metric not in reference:
+                continue
+            current = values[metric]
+            if current['median'] > reference[metric] * (1 + tolerance) and current['low'] > reference[metric]:
+                regressions.append((label, name, metric, reference[metric], current['median']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an aligner command over simulation sets with repeated, resource-sampled trials.")
+    parser.add_argument("--label", required=True, help="Name of the aligner/configuration, e.g. safari")
+    parser.add_argument("--command", help="Shell command template; {input}, {name} and {trial} are filled in")
+    parser.add_argument("--inputs", nargs='*', default=[], help="Input files or glob patterns")
+    parser.add_argument("--trials", type=int, default=3, help="Trials per input")
+    parser.add_argument("--interval", type=float, default=0.1, help="Resource sampling interval in seconds")
+    parser.add_argument("--history", default="benchmark_history.jsonl", help="Append-only trial history")
+    parser.add_argument("--report-only", action="store_true", help="Summarize the stored history of --label without running")
+    parser.add_argument("--baseline", default=None, help="Baseline JSON to compare medians against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative slack before a slower/larger median is a regression")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this summary as the new --baseline")
+    args = parser.parse_args()
+
+    if args.report_only:
+        records = load_history(args.history, args.label)
+    else:
+        if not args.command:
+            parser.error("--command is required unless --report-only is given")
+        inputs = sorted(set(path for pattern in args.inputs for path in (glob.glob(pattern) or [pattern])))
+        records = run_benchmarks(args.label, args.command, inputs, args.trials, args.interval, args.history)
+
+    summary = summarize(records)
+    print_summary(summary)
+
+    if args.baseline and args.update_baseline:
+        save_baseline(summary, args.baseline)
+    elif args.baseline and os.path.exists(args.baseline):
+        regressions = find_regressions(summary, args.baseline, args.tolerance)
+        for label, name, metric, reference, current in regressions:
+            print(f'REGRESSION {label} {name} {metric}: {reference:.3f} -> {current:.3f}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,20 @@
 import os
+import argparse
 import glob
 import pandas as pd
 import numpy as np
-import io
 import re
 import matplotlib.pyplot as plt
 from collections import defaultdict
 from math import sqrt
 
+SUBSTITUTIONS = ['A>C', 'A>G', 'A>T', 'C>A', 'C>G', 'C>T', 'G>A', 'G>C', 'G>T', 'T>A', 'T>C', 'T>G']
+PROF_ENDS = ['5p', '3p']
+
 def clean_data(df):
     assert df is not None, "DataFrame should not be None."
+    if all(pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes):
+        return df.astype(float)
     df = df.applymap(lambda x: re.search(r"([\d\.]+)", str(x)).group(1) if re.search(r"([\d\.]+)", str(x)) else np.nan)
     return df.astype(float)
 
@@ -39,26 +44,56 @@ def load_damage_data(file_name):
         return None
     return data
 
+def parse_prof(file_path):
+    # A bam2prof file holds a 5' and a 3' table, each a header line of the
+    # 12 substitutions followed by one row per position. Returns a
+    # (2, positions, 12) float array, or None for an empty file.
+    with open(file_path, 'rb') as file:
+        lines = file.read().split(b'\n')
+    headers = [i for i, line in enumerate(lines) if line.startswith(b'A>C')]
+    if not headers:
+        return None
+    assert len(headers) == 2, f"Expected two tables in {file_path}"
+    values = np.array(b' '.join(lines[headers[0] + 1:headers[1]] + lines[headers[1] + 1:]).split(), dtype=float)
+    assert values.size % 24 == 0, f"Ragged tables in {file_path}"
+    return values.reshape(2, -1, 12)
+
 def load_prof_data(file_name):
     file_path = os.path.join(prof_data_path, file_name)
     assert os.path.exists(file_path), f"File path does not exist: {file_path}"
     if os.path.getsize(file_path) == 0:
         return None, None
     try:
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-            second_header_index = len(lines) // 2
-            assert second_header_index > 0, "Invalid file format."
-            table1_lines = lines[:second_header_index]
-            table2_lines = lines[second_header_index:]
-
-        table1 = pd.read_csv(io.StringIO(''.join(table1_lines)), delimiter='\t', header=0)
-        table2 = pd.read_csv(io.StringIO(''.join(table2_lines)), delimiter='\t', header=0)
-        assert not (table1.empty or table2.empty), f"No data in file {file_name}."
+        tables = parse_prof(file_path)
+        assert tables is not None and tables.shape[1] > 0, f"No data in file {file_name}."
     except Exception as e:
         print(f'Error reading {file_name}: {e}')
         return None, None
-    return table1, table2
+    return pd.DataFrame(tables[0], columns=SUBSTITUTIONS), pd.DataFrame(tables[1], columns=SUBSTITUTIONS)
+
+def load_prof_tensor(prof_files):
+    # Stacks every profile into one (files, end, position, 12) array, NaN-padded
+    # if profiles differ in length, with a matching metadata index.
+    # Empty or unreadable files are skipped.
+    tables, index = [], []
+    for file_path in sorted(prof_files):
+        file_name = os.path.basename(file_path)
+        try:
+            profile = parse_prof(file_path)
+        except Exception as e:
+            print(f'Error reading {file_name}: {e}')
+            continue
+        if profile is None:
+            continue
+        tables.append(profile)
+        index.append({'file': file_name, 'aligner': extract_aligner(file_name),
+                      'damage_type': extract_damage_type(file_name), 'positions': profile.shape[1]})
+
+    positions = max((profile.shape[1] for profile in tables), default=0)
+    tensor = np.full((len(tables), len(PROF_ENDS), positions, len(SUBSTITUTIONS)), np.nan)
+    for i, profile in enumerate(tables):
+        tensor[i, :, :profile.shape[1]] = profile
+    return tensor, pd.DataFrame(index, columns=['file', 'aligner', 'damage_type', 'positions'])
 
 def mean_squared_error(true_values, predicted_values):
     assert len(true_values) == len(predicted_values), "Length mismatch between true and predicted values."
@@ -90,6 +125,66 @@ def compute_rmse_divergence(true_data, estimated_data, aligner, damage_type):
 
     return rmse, len(true_data)
 
+def truth_key(damage_type, positions):
+    true_data_key = f'{damage_type}{positions}.dat'
+    if true_data_key in ['high5.dat', 'high3.dat', 'mid5.dat', 'mid3.dat']:
+        true_data_key = "d" + true_data_key
+    return true_data_key
+
+def load_truth_tensor(damage_data_dict, prof_index):
+    # One cleaned ground-truth matrix per (damage type, table length) used by
+    # the profiles, stacked into a (keys, positions, 12) array. truth_of_file
+    # maps every profile to its row; a missing truth file becomes all-NaN.
+    keys = sorted(set(truth_key(d, n) for d, n in zip(prof_index['damage_type'], prof_index['positions'])))
+    positions = max(prof_index['positions'], default=0)
+    truth = np.full((len(keys), positions, len(SUBSTITUTIONS)), np.nan)
+    for i, key in enumerate(keys):
+        data = damage_data_dict.get(key)
+        if data is None:
+            continue
+        values = clean_data(data).values
+        truth[i, :values.shape[0]] = values[:positions]
+    truth_of_file = np.array([keys.index(truth_key(d, n)) for d, n in zip(prof_index['damage_type'], prof_index['positions'])], dtype=int)
+    return truth, truth_of_file
+
+def batched_rmse(prof_tensor, truth, truth_of_file):
+    # RMSE of every (profile, end) table against its ground truth at once.
+    # Rows with a NaN on either side are dropped, as in compute_rmse_divergence;
+    # tables with no usable row get NaN and a count of 0.
+    estimated = prof_tensor
+    true = truth[truth_of_file][:, None]
+    valid = ~(np.isnan(estimated).any(axis=-1) | np.isnan(true).any(axis=-1))
+    squared = np.where(valid[..., None], (estimated - true) ** 2, 0.0).sum(axis=(-1, -2))
+    counts = valid.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rmse = np.sqrt(squared / (counts * estimated.shape[-1]))
+    return np.where(counts > 0, rmse, np.nan), counts
+
+def summarize_rmse(prof_index, rmse, counts, by=('aligner', 'damage_type')):
+    # Long table with one row per profile and end, reduced to mean RMSE and
+    # total sample count per group; ('aligner', 'damage_type', 'end') also works
+    long = prof_index.loc[prof_index.index.repeat(len(PROF_ENDS))].reset_index(drop=True)
+    long['end'] = np.tile(PROF_ENDS, len(prof_index))
+    long['rmse'] = rmse.ravel()
+    long['samples'] = counts.ravel()
+    long = long[long['samples'] > 0]
+    return long.groupby(list(by)).agg(rmse=('rmse', 'mean'), samples=('samples', 'sum'), tables=('rmse', 'size')).reset_index()
+
+def check_data_batched(damage_data_dict, prof_files):
+    prof_tensor, prof_index = load_prof_tensor(prof_files)
+    truth, truth_of_file = load_truth_tensor(damage_data_dict, prof_index)
+    rmse, counts = batched_rmse(prof_tensor, truth, truth_of_file)
+    summary = summarize_rmse(prof_index, rmse, counts)
+
+    rmse_mean_data = defaultdict(lambda: defaultdict(float))
+    rmse_sample_count_data = defaultdict(lambda: defaultdict(int))
+    for row in summary.itertuples():
+        rmse_mean_data[row.aligner][row.damage_type] = row.rmse
+        rmse_sample_count_data[row.aligner][row.damage_type] = row.samples
+
+    plot_rmse(rmse_mean_data, rmse_sample_count_data, 'mean RMSE by Aligner and Damage Type', 'rmse_plot.png')
+    return summary
+
 def filter_rmse_data_for_giraffe_and_safari(rmse_data):
     filtered_rmse_data = defaultdict(lambda: defaultdict(float))
     for aligner in ['giraffe', 'safari']:
@@ -147,11 +242,7 @@ def check_data(damage_data_dict, prof_data_dict):
         aligner = extract_aligner(file_name)
 
         if table1 is not None:
-            true_data_key = f'{damage_type}{len(table1)}.dat'
-            if true_data_key in ['high5.dat', 'high3.dat', 'mid5.dat', 'mid3.dat']:
-                true_data_key = "d" + true_data_key
-
-            true_data = damage_data_dict.get(true_data_key)
+            true_data = damage_data_dict.get(truth_key(damage_type, len(table1)))
             rmse_table1, sample_count_table1 = compute_rmse_divergence(true_data, table1, aligner, damage_type)
 
             if rmse_table1 is not None:
@@ -159,11 +250,7 @@ def check_data(damage_data_dict, prof_data_dict):
                 rmse_sample_count_data[aligner][damage_type] += sample_count_table1
 
         if table2 is not None:
-            true_data_key = f'{damage_type}{len(table2)}.dat'
-            if true_data_key in ['high5.dat', 'high3.dat', 'mid5.dat', 'mid3.dat']:
-                true_data_key = "d" + true_data_key
-
-            true_data = damage_data_dict.get(true_data_key)
+            true_data = damage_data_dict.get(truth_key(damage_type, len(table2)))
             rmse_table2, sample_count_table2 = compute_rmse_divergence(true_data, table2, aligner, damage_type)
 
             if rmse_table2 is not None:
@@ -179,8 +266,14 @@ def check_data(damage_data_dict, prof_data_dict):
     #filtered_rmse_data = filter_rmse_data_for_giraffe_and_safari(rmse_mean_data)
 
 if __name__ == "__main__":
-    damage_data_path = '.'  # Your path to damage data files
-    prof_data_path = 'alignments/profs'  # Your path to prof data files
+    parser = argparse.ArgumentParser(description="Compare bam2prof damage estimates against the simulated ground truth.")
+    parser.add_argument("--damage-data", default='.', help="Directory holding the ground truth .dat files")
+    parser.add_argument("--profs", default='alignments/profs', help="Directory holding the .prof files")
+    parser.add_argument("--batched", action="store_true", help="Compute all RMSEs in one vectorized pass")
+    args = parser.parse_args()
+
+    damage_data_path = args.damage_data  # Your path to damage data files
+    prof_data_path = args.profs  # Your path to prof data files
 
     assert os.path.exists(damage_data_path), "Damage data path does not exist."
     assert os.path.exists(prof_data_path), "Prof data path does not exist."
@@ -192,7 +285,10 @@ if __name__ == "__main__":
     assert prof_data_files, "No prof data files found."
 
     damage_data_dict = {os.path.basename(file_name): load_damage_data(os.path.basename(file_name)) for file_name in damage_data_files}
-    prof_data_dict = {os.path.basename(file_name): load_prof_data(os.path.basename(file_name)) for file_name in prof_data_files}
 
-    check_data(damage_data_dict, prof_data_dict)
+    if args.batched:
+        check_data_batched(damage_data_dict, prof_data_files)
+    else:
+        prof_data_dict = {os.path.basename(file_name): load_prof_data(os.path.basename(file_name)) for file_name in prof_data_files}
+        check_data(damage_data_dict, prof_data_dict)
 
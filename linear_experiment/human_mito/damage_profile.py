@@ -0,0 +1,212 @@
+#!/usr/bin/python
+
+import argparse
+import os
+import sys
+import numpy as np
+import pysam
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from parseBamMito import expand_inputs
+
+pysam.set_verbosity(0)
+
+SUBSTITUTIONS = ['A>C', 'A>G', 'A>T', 'C>A', 'C>G', 'C>T', 'G>A', 'G>C', 'G>T', 'T>A', 'T>C', 'T>G']
+# A/C/G/T -> 0..3, anything else -> 4; COMPLEMENT maps a code to its complement
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate('ACGT'):
+    BASE_CODES[ord(base)] = BASE_CODES[ord(base.lower())] = code
+COMPLEMENT = np.array([3, 2, 1, 0, 4], dtype=np.uint8)
+ALIGNED_OPS = [0, 7, 8]
+QUERY_OPS = [0, 1, 4, 7, 8]
+REFERENCE_OPS = [0, 2, 3, 7, 8]
+
+references = {}
+
+def load_reference(fasta_path):
+    # Contig name -> base codes, parsed once per process
+    if fasta_path not in references:
+        sequences, name, chunks = {}, None, []
+        with open(fasta_path, 'rb') as f:
+            for line in f:
+                if line.startswith(b'>'):
+                    if name is not None:
+                        sequences[name] = BASE_CODES[np.frombuffer(b''.join(chunks), dtype=np.uint8)]
+                    name, chunks = line[1:].split()[0].decode(), []
+                else:
+                    chunks.append(line.strip())
+        if name is not None:
+            sequences[name] = BASE_CODES[np.frombuffer(b''.join(chunks), dtype=np.uint8)]
+        references[fasta_path] = sequences
+    return references[fasta_path]
+
+def choose_reference(bam, fasta_paths):
+    # The first FASTA holding every @SQ contig at its declared length. The name
+    # alone is not enough: the BAMs declare generation_0 with LN:16569, the
+    # rCRS length, while the generation_0 record of gen_0.fa is 16576 bp.
+    for fasta_path in fasta_paths:
+        try:
+            return reference_table(bam, load_reference(fasta_path))
+        except ValueError:
+            continue
+    header = ', '.join(f'{name} (LN:{length})' for name, length in zip(bam.references, bam.lengths))
+    raise ValueError(f'No reference among {", ".join(fasta_paths)} matches {header}')
+
+def reference_table(bam, sequences):
+    # One array holding every contig of the BAM header followed by its
+    # complement, the contig offsets into it, and the complement's offset.
+    # A single-record FASTA is used for a single-contig BAM if the names differ
+    # but the lengths agree (e.g. rCRS.fa against an @SQ line named generation_0).
+    contigs = []
+    for name, length in zip(bam.references, bam.lengths):
+        if name in sequences:
+            contig = sequences[name]
+        elif len(sequences) == 1 and len(bam.references) == 1:
+            contig = next(iter(sequences.values()))
+        else:
+            raise ValueError(f'{name} is not in the reference')
+        if len(contig) != length:
+            raise ValueError(f'{name} is {length} bp in the BAM header but {len(contig)} bp in the reference')
+        contigs.append(contig)
+    forward = np.concatenate(contigs + [np.array([4], dtype=np.uint8)])
+    offsets = np.cumsum([0] + [len(contig) for contig in contigs])[:-1]
+    lengths = np.array([len(contig) for contig in contigs])
+    return np.concatenate([forward, COMPLEMENT[forward]]), offsets, lengths, len(forward)
+
+def query_to_reference(cigartuples, reference_start, query_positions):
+    # Reference coordinate of each query position; -1 for soft-clipped or inserted bases
+    cigar = np.array(cigartuples, dtype=np.int64).reshape(-1, 2)
+    ops, lengths = cigar[:, 0], cigar[:, 1]
+    query_lengths = np.where(np.isin(ops, QUERY_OPS), lengths, 0)
+    reference_lengths = np.where(np.isin(ops, REFERENCE_OPS), lengths, 0)
+    query_end = np.cumsum(query_lengths)
+    reference_end = reference_start + np.cumsum(reference_lengths)
+    block = np.minimum(np.searchsorted(query_end, query_positions, side='right'), len(ops) - 1)
+    offset = query_positions - (query_end[block] - query_lengths[block])
+    aligned = np.isin(ops[block], ALIGNED_OPS)
+    return np.where(aligned, reference_end[block] - reference_lengths[block] + offset, -1)
+
+def end_positions(read_length, length, reverse):
+    # Query positions of the first `length` bases from the molecule's 5' end
+    # (row 0) and 3' end (row 1); -1 past the end of short reads
+    steps = np.arange(length)
+    from_left = np.where(steps < read_length, steps, -1)
+    from_right = np.where(steps < read_length, read_length - 1 - steps, -1)
+    return np.stack([from_right, from_left]) if reverse else np.stack([from_left, from_right])
+
+def profile_counts(bam_path, fasta_paths, length=5, minl=20, paired=False, threads=1, batch_size=1 << 14):
+    # counts[end, position, reference base, read base] in molecule orientation,
+    # codes 0..3 for ACGT and 4 for anything else. Reverse-strand reads are
+    # complemented and read from the right. Unpaired (merged) reads give both
+    # ends. With paired=True the first mate gives the 5' end and the second
+    # mate, whose strand is flipped, gives the 3' end; otherwise paired reads
+    # are skipped.
+    counts = np.zeros(2 * length * 25, dtype=np.int64)
+    bam = pysam.AlignmentFile(bam_path, "rb", threads=threads, check_sq=False)
+    reference, offsets, contig_lengths, complement_offset = choose_reference(bam, fasta_paths)
+    missing = complement_offset - 1
+    cells = (np.arange(2)[:, None] * length + np.arange(length)[None, :]) * 25
+    batch = {'read': [], 'reference': [], 'cell': []}
+
+    def flush():
+        if not batch['read']:
+            return
+        read_codes = np.concatenate(batch['read'])
+        reference_codes = reference[np.concatenate(batch['reference'])]
+        valid = (read_codes < 4) & (reference_codes < 4)
+        index = np.concatenate(batch['cell'])[valid] + reference_codes[valid] * 5 + read_codes[valid]
+        counts[:] += np.bincount(index, minlength=len(counts))
+        for values in batch.values():
+            values.clear()
+
+    for read in bam.fetch(until_eof=True):
+        if read.is_unmapped or read.is_secondary or read.is_supplementary or read.is_qcfail or read.is_duplicate:
+            continue
+        read_length = read.query_length
+        if read_length < minl:
+            continue
+        reverse = read.is_reverse
+        ends = [0, 1]
+        if read.is_paired:
+            if not paired:
+                continue
+            ends = [0] if read.is_read1 else [1]
+            reverse = reverse != read.is_read2
+
+        positions = end_positions(read_length, length, reverse)[ends]
+        query = np.maximum(positions, 0)
+        reference_positions = query_to_reference(read.cigartuples, read.reference_start, query)
+        usable = (positions >= 0) & (reference_positions >= 0) & (reference_positions < contig_lengths[read.reference_id])
+        reference_index = np.where(usable, offsets[read.reference_id] + reference_positions, missing)
+        read_codes = BASE_CODES[np.frombuffer(read.query_sequence.encode(), dtype=np.uint8)[query]]
+        if reverse:
+            read_codes = COMPLEMENT[read_codes]
+            reference_index = reference_index + complement_offset
+        batch['read'].append(read_codes.ravel())
+        batch['reference'].append(reference_index.ravel())
+        batch['cell'].append(cells[ends].ravel())
+        if len(batch['read']) == batch_size:
+            flush()
+    flush()
+    bam.close()
+    return counts.reshape(2, length, 5, 5)
+
+def profile_frequencies(counts):
+    # Frequency of each X>Y among all positions where the reference has X
+    counts = counts[:, :, :4, :4].astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frequencies = counts / counts.sum(axis=-1, keepdims=True)
+    pairs = [(x, y) for x in range(4) for y in range(4) if x != y]
+    return frequencies[:, :, [x for x, _ in pairs], [y for _, y in pairs]]
+
+def format_prof(frequencies):
+    # bam2prof -both layout: a 5' table then a 3' table, each under the substitution header
+    lines = []
+    for table in frequencies:
+        lines.append('\t'.join(SUBSTITUTIONS))
+        for row in table:
+            lines.append('\t'.join('-nan' if np.isnan(value) else f'{value:.6g}' for value in row))
+    return '\n'.join(lines) + '\n'
+
+def profile_bam(bam_path, output_dir, fasta_paths, length, minl, threads):
+    # Double-stranded library, as make_profs.sh runs bam2prof -paired -double.
+    # Single-stranded runs (bam2prof -single, C>T expected at both ends) are
+    # refused rather than profiled with double-stranded 3' end semantics.
+    base_name = os.path.basename(bam_path)[:-len('.bam')]
+    if 'single' in base_name:
+        raise ValueError('single-stranded libraries are not supported; use bam2prof -single')
+    counts = profile_counts(bam_path, fasta_paths, length, minl, True, threads)
+    output_path = os.path.join(output_dir, base_name + '.prof')
+    with open(output_path, 'w') as f:
+        f.write(format_prof(profile_frequencies(counts)))
+    return output_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Substitution profiles at the 5' and 3' ends of aligned reads, in bam2prof -both format.")
+    parser.add_argument("inputs", nargs='+', help="BAM files, directories of BAMs or glob patterns")
+    parser.add_argument("-o", "--output-dir", default="alignments/profs", help="Directory for the .prof files")
+    parser.add_argument("--references", nargs='+', default=["simulations/gen_0.fa", "rCRS.fa"],
+                        help="Candidate FASTAs; each BAM uses the first whose record lengths match its @SQ lines")
+    parser.add_argument("--length", type=int, default=5, help="Positions reported from each end")
+    parser.add_argument("--minl", type=int, default=20, help="Minimum read length")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of BAMs processed in parallel")
+    parser.add_argument("-@", "--threads", type=int, default=1, help="BGZF decompression threads per BAM")
+    args = parser.parse_args()
+
+    bam_paths = expand_inputs(args.inputs)
+    os.makedirs(args.output_dir, exist_ok=True)
+    workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(profile_bam, path, args.output_dir, args.references,
+                                   args.length, args.minl, args.threads): path for path in bam_paths}
+        for done, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f'Error processing {path}: {e}', file=sys.stderr)
+                continue
+            print(f'[{done}/{len(bam_paths)}] {os.path.basename(path)}', file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
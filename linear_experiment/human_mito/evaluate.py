@@ -1,11 +1,16 @@
 import os
 import re
 import csv
+import json
+import hashlib
+import argparse
+
+CSV_HEADER = ['Damage_Type', 'Aligner_Name', 'Subsampling_Rate', 'TP', 'FP', 'TN', 'FN', 'TP_MQ30', 'FP_MQ30', 'TN_MQ30', 'FN_MQ30']
 
 def parse_stat_file(file_path):
     with open(file_path, 'r') as file:
         lines = file.readlines()
-    
+
     stats = {}
     for line in lines:
         parts = line.strip().split(":")
@@ -15,7 +20,7 @@ def parse_stat_file(file_path):
         if not value.strip().isdigit():  # Skip lines without a numeric value after the colon
             continue
         stats[key.strip()] = int(value.strip())
-    
+
     return stats
 
 def get_aligner_name_and_damage_type(filename):
@@ -27,41 +32,99 @@ def get_aligner_name_and_damage_type(filename):
     else:
         raise ValueError(f'Unexpected file name format: {filename}')
 
-def compute_proportion(directory, output_csv_path):
-    files = [f for f in os.listdir(directory) if f.endswith('.stat')]
-    
-    data = []
-    
-    for file in files:
-        file_path = os.path.join(directory, file)
-        stats = parse_stat_file(file_path)
-        
-        tp = stats.get('True Positives (TP)', 0)
-        fp = stats.get('False Positives (FP)', 0)
-        tn = stats.get('True Negatives (TN)', 0)
-        fn = stats.get('False Negatives (FN)', 0)
-        
-        tp_mq30 = stats.get('True Positives (TP_MQ30)', 0)
-        fp_mq30 = stats.get('False Positives (FP_MQ30)', 0)
-        tn_mq30 = stats.get('True Negatives (TN_MQ30)', 0)
-        fn_mq30 = stats.get('False Negatives (FN_MQ30)', 0)
-        
-        aligner_name, damage_type, subsampling_rate = get_aligner_name_and_damage_type(file)
-        
-        data.append([damage_type, aligner_name, subsampling_rate, tp, fp, tn, fn, tp_mq30, fp_mq30, tn_mq30, fn_mq30])
-    
+def stat_row(directory, file):
+    file_path = os.path.join(directory, file)
+    stats = parse_stat_file(file_path)
+
+    tp = stats.get('True Positives (TP)', 0)
+    fp = stats.get('False Positives (FP)', 0)
+    tn = stats.get('True Negatives (TN)', 0)
+    fn = stats.get('False Negatives (FN)', 0)
+
+    tp_mq30 = stats.get('True Positives (TP_MQ30)', 0)
+    fp_mq30 = stats.get('False Positives (FP_MQ30)', 0)
+    tn_mq30 = stats.get('True Negatives (TN_MQ30)', 0)
+    fn_mq30 = stats.get('False Negatives (FN_MQ30)', 0)
+
+    aligner_name, damage_type, subsampling_rate = get_aligner_name_and_damage_type(file)
+
+    return [damage_type, aligner_name, subsampling_rate, tp, fp, tn, fn, tp_mq30, fp_mq30, tn_mq30, fn_mq30]
+
+def write_csv(data, output_csv_path):
     with open(output_csv_path, 'w', newline='') as csvfile:
         csvwriter = csv.writer(csvfile)
-        
-        csvwriter.writerow(['Damage_Type', 'Aligner_Name', 'Subsampling_Rate', 'TP', 'FP', 'TN', 'FN', 'TP_MQ30', 'FP_MQ30', 'TN_MQ30', 'FN_MQ30'])
-        
+
+        csvwriter.writerow(CSV_HEADER)
+
         for row in data:
             csvwriter.writerow(row)
 
-# Define the directory path and output CSV path
-directory_path = '/home/projects/MAAG/Magpie/Magpie/linear_experiment/human_mito/alignments'
-output_csv_path = 'alignment_stats.csv'
+def compute_proportion(directory, output_csv_path):
+    files = [f for f in os.listdir(directory) if f.endswith('.stat')]
 
-# Compute and save the new statistics
-compute_proportion(directory_path, output_csv_path)
+    data = []
+
+    for file in files:
+        data.append(stat_row(directory, file))
+
+    write_csv(data, output_csv_path)
+
+def file_sha1(file_path):
+    with open(file_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def compute_proportion_incremental(directory, output_csv_path, manifest_path):
+    # The manifest maps each .stat file name to its size, mtime, SHA-1 and
+    # parsed row. Only files whose size or mtime changed are hashed, and only
+    # files whose content changed are parsed again.
+    manifest = load_manifest(manifest_path)
+    updated = {}
+    reparsed = 0
 
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.stat'):
+            continue
+        info = entry.stat()
+        previous = manifest.get(entry.name)
+        if previous and previous['size'] == info.st_size and previous['mtime_ns'] == info.st_mtime_ns:
+            updated[entry.name] = previous
+            continue
+
+        digest = file_sha1(entry.path)
+        if previous and previous['sha1'] == digest:
+            row = previous['row']
+        else:
+            row = stat_row(directory, entry.name)
+            reparsed += 1
+        updated[entry.name] = {'size': info.st_size, 'mtime_ns': info.st_mtime_ns, 'sha1': digest, 'row': row}
+
+    removed = len(set(manifest) - set(updated))
+    write_csv([updated[name]['row'] for name in sorted(updated)], output_csv_path)
+    save_manifest(updated, manifest_path)
+    print(f'{len(updated)} stat files, {reparsed} parsed, {removed} removed')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect alignment statistics from .stat files into a CSV table.")
+    parser.add_argument("--directory", default='/home/projects/MAAG/Magpie/Magpie/linear_experiment/human_mito/alignments', help="Directory holding the .stat files")
+    parser.add_argument("--output", default='alignment_stats.csv', help="Output CSV path")
+    parser.add_argument("--incremental", action="store_true", help="Only reparse new or changed .stat files, tracked in a manifest")
+    parser.add_argument("--manifest", default=None, help="Manifest path for --incremental (default: <output>.manifest.json)")
+    args = parser.parse_args()
+
+    # Compute and save the new statistics
+    if args.incremental:
+        compute_proportion_incremental(args.directory, args.output, args.manifest or args.output + '.manifest.json')
+    else:
+        compute_proportion(args.directory, args.output)
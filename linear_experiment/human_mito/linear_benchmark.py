@@ -1,13 +1,106 @@
 
+import os
+import re
+import sys
+import argparse
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+BAM_NAME = re.compile(r'_n(?P<nfrags>\d+)(?:_l(?P<length>\d+))?_d(?P<damage>[^_]+)_s(?P<rate>[\d.]+)_(?P<aligner>\w+)\.bam$')
+# correct/misplaced are mapped reads at / away from their true location, not
+# the TP/FP (mapped to MT or not) of the .stat files
+CURVE_COLUMNS = ['mapq_threshold', 'correct', 'misplaced', 'precision', 'recall']
 
 def calculate_precision_recall(df):
     precision = df['TP'] / (df['TP'] + df['FP'])
     recall = df['TP'] / (df['TP'] + df['FN'])
     return precision, recall
 
+def read_outcomes(bam_path):
+    # Per mapped read: MAPQ and whether it is a generation read placed at its
+    # true location (correct), a misplaced generation read, or a numtS/other
+    # read; plus the number of generation reads in the BAM for recall
+    from parseBamMito import extract_columns, classify_reads
+    columns = extract_columns(bam_path)
+    mapped, positive, correct = classify_reads(columns)
+    return columns['mapq'][mapped], correct[mapped], int(positive.sum())
+
+def pr_curve(mapq, correct, positives):
+    # Reads with MAPQ > threshold at every threshold of the parseBamMito.py
+    # threshold table, counted with the same helper, strictest threshold first
+    from parseBamMito import count_above, MAX_MAPQ
+    if len(mapq) == 0:
+        return pd.DataFrame({column: [] for column in CURVE_COLUMNS})
+    thresholds = np.arange(MAX_MAPQ)[::-1]
+    called = count_above(mapq, np.ones(len(mapq), dtype=bool))[thresholds]
+    placed = count_above(mapq, correct)[thresholds]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = placed / called
+    return pd.DataFrame({'mapq_threshold': thresholds, 'correct': placed, 'misplaced': called - placed,
+                         'precision': precision, 'recall': placed / positives if positives else np.nan})
+
+def stratum_curves(bam_paths, workers=None):
+    # One curve per (aligner, damage type, simulation set), from its highest
+    # subsampling rate only: the rates are nested, so pooling them would count
+    # a read once per rate. Of two spellings of that rate (s0.1 and s0.10) the
+    # first is used.
+    rates = {}
+    for path in sorted(bam_paths):
+        match = BAM_NAME.search(os.path.basename(path))
+        if match is None:
+            continue
+        key = (match.group('aligner'), match.group('damage'), int(match.group('nfrags')), int(match.group('length') or -1))
+        rates.setdefault(key, {}).setdefault(float(match.group('rate')), []).append(path)
+    strata = {}
+    for key, by_rate in rates.items():
+        rate = max(by_rate)
+        for path in by_rate[rate][1:]:
+            print(f'Skipping {path}: same rate as {by_rate[rate][0]}', file=sys.stderr)
+        strata[key] = (rate, by_rate[rate][0])
+
+    paths = [strata[key][1] for key in sorted(strata)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        outcomes = dict(zip(paths, executor.map(read_outcomes, paths)))
+
+    curves = []
+    for (aligner, damage_type, nfrags, length), (rate, path) in sorted(strata.items()):
+        curve = pr_curve(*outcomes[path])
+        curve.insert(0, 'Rate', rate)
+        curve.insert(0, 'Length', length)
+        curve.insert(0, 'Nfrags', nfrags)
+        curve.insert(0, 'Damage_Type', damage_type)
+        curve.insert(0, 'Aligner_Name', aligner)
+        curves.append(curve)
+    return pd.concat(curves, ignore_index=True)
+
+def plot_pr_curves(curves, output_path):
+    damage_types = sorted(curves['Damage_Type'].unique())
+    strata = curves[['Aligner_Name', 'Nfrags', 'Length']].drop_duplicates().sort_values(['Aligner_Name', 'Nfrags', 'Length'])
+    several_sets = len(curves[['Nfrags', 'Length']].drop_duplicates()) > 1
+    fig, axs = plt.subplots(1, len(damage_types), figsize=(7 * len(damage_types), 6), squeeze=False)
+    for ax, damage_type in zip(axs[0], damage_types):
+        for aligner, nfrags, length in strata.itertuples(index=False):
+            curve = curves[(curves['Damage_Type'] == damage_type) & (curves['Aligner_Name'] == aligner) &
+                           (curves['Nfrags'] == nfrags) & (curves['Length'] == length)]
+            if curve.empty:
+                continue
+            label = aligner
+            if several_sets:
+                label += f' n{nfrags}' + (f' l{length}' if length >= 0 else '')
+            ax.step(curve['recall'], curve['precision'], where='post', linewidth=1.5, label=label)
+        ax.set_title(f'Damage: {damage_type}')
+        ax.set_xlabel('Recall')
+        ax.set_ylabel('Precision')
+        ax.grid(True)
+    axs[0][-1].legend(loc='lower left')
+    fig.tight_layout()
+    fig.savefig(output_path, dpi=300)
+    plt.close(fig)
+
 def main(file_path):
     # Load data
     data = pd.read_csv(file_path)
@@ -66,9 +159,21 @@ def main(file_path):
     plt.savefig('precision_recall_tradeoff.png', dpi=300)
 
 if __name__ == '__main__':
-    import sys
-    if len(sys.argv) != 2:
-        print("Usage: python this_script.py <path_to_alignment_stats.csv>")
+    parser = argparse.ArgumentParser(description="Precision-recall plots for the aligners.")
+    parser.add_argument("stats", nargs='?', help="alignment_stats.csv for the fitted giraffe/SAFARI curves")
+    parser.add_argument("--bams", nargs='+', help="BAM files, directories or globs for exact MAPQ-threshold curves of every aligner and damage type")
+    parser.add_argument("--curves", default="precision_recall_curves.tsv", help="Table of the exact curves")
+    parser.add_argument("--plot", default="precision_recall_curves.png", help="Plot of the exact curves")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="BAMs read in parallel")
+    args = parser.parse_args()
+
+    if args.bams:
+        from parseBamMito import expand_inputs
+        curves = stratum_curves(expand_inputs(args.bams), args.workers)
+        curves.to_csv(args.curves, sep='\t', index=False)
+        plot_pr_curves(curves, args.plot)
+    elif args.stats:
+        main(args.stats)
     else:
-        main(sys.argv[1])
-
+        print("Usage: python this_script.py <path_to_alignment_stats.csv> | --bams <BAMs>")
+        sys.exit(1)
@@ -1,57 +1,214 @@
 #!/usr/bin/python
 
+import argparse
+import csv
+import glob
+import os
+import numpy as np
 import pysam
-import sys; 
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 pysam.set_verbosity(0)
-bamInputFile  = pysam.Samfile(sys.argv[1], "rb");
-#bamOutputFile = pysam.Samfile(sys.argv[2], "wb", template=bamInputFile);
-
-mapped=0;
-unmapped=0;
-correctlocationmapped=0;
-numt=0;
-total=0;
+
+STAT_COLUMNS = ['total', 'unmapped', 'mapped', 'correctmap', 'numt',
+                'TP', 'FP', 'TN', 'FN', 'TP_MQ30', 'FP_MQ30', 'TN_MQ30', 'FN_MQ30',
+                'correctmap_MQ30', 'numt_MQ30']
+MAX_MAPQ = 255
+
 def intersects(left1,right1,left2,right2):
-    return not (right1 < left2 or left1 > right2)
-
-for read in bamInputFile:
-    if(read.is_unmapped):
-        unmapped+=1;
-        continue;
-
-    
-    if(read.query_name[0:10] == "generation"):
-        mapped+=1;
-        fields=read.query_name.split(":");
-        #print(fields);
-        #print(read.reference_start)
-        #print(read.reference_start+read.reference_length);
-        intcs=intersects(int(fields[2]),int(fields[3]),read.reference_start-50,read.reference_start+read.reference_length+50);
-        #print(intcs);
-        if(intcs):
-            correctlocationmapped+=1;
-            
-    else:
-        numt+=1;
-    total+=1;
-    
-    #bamOutputFile.write(read);
-                
-bamInputFile.close();
-#bamOutputFile.close();
-
-
-print("Total:\t"+str(total));
-print("unmapped:\t"+str(unmapped));
-print("unmapped%:\t"+str(100*(unmapped/total)));
-print("mapped:\t"+str(mapped));
-print("mapped%:\t"+str(100*(mapped/total)));
-print("correctmap:\t"+str(correctlocationmapped));
-print("correctmap%:\t"+str(100*(correctlocationmapped/mapped)));
-print("numt:\t"+str(numt));
-print("numt%:\t"+str(100*(numt/total)));
+    # Works elementwise on NumPy arrays as well as on scalars
+    return np.logical_not((right1 < left2) | (left1 > right2))
+
+def extract_columns(bam_path, threads=1, batch_size=1 << 16):
+    # One pass over the BAM into NumPy columns. Reads simulated from the
+    # mitogenome are named generation...:<start>:<end>:..., which gives their
+    # true interval; every other read (numtS, bacteria) gets -1.
+    bamInputFile = pysam.AlignmentFile(bam_path, "rb", threads=threads, check_sq=False)
+    columns = {name: [] for name in ('unmapped', 'start', 'end', 'mapq', 'truth_start', 'truth_end')}
+    batch = {name: [] for name in columns}
+
+    def flush():
+        for name, values in batch.items():
+            columns[name].append(np.array(values, dtype=np.int64))
+            values.clear()
+
+    for read in bamInputFile.fetch(until_eof=True):
+        batch['unmapped'].append(read.is_unmapped)
+        batch['start'].append(read.reference_start)
+        batch['end'].append(read.reference_end if read.reference_end is not None else -1)
+        batch['mapq'].append(read.mapping_quality)
+        name = read.query_name
+        if(name.startswith("generation")):
+            fields=name.split(":", 4)
+            batch['truth_start'].append(int(fields[2]))
+            batch['truth_end'].append(int(fields[3]))
+        else:
+            batch['truth_start'].append(-1)
+            batch['truth_end'].append(-1)
+        if len(batch['start']) == batch_size:
+            flush()
+    flush()
+    bamInputFile.close()
+
+    columns = {name: np.concatenate(chunks) for name, chunks in columns.items()}
+    columns['unmapped'] = columns['unmapped'].astype(bool)
+    return columns
+
+def classify_reads(columns, slack=50):
+    mapped = ~columns['unmapped']
+    positive = columns['truth_start'] >= 0
+    correct = mapped & positive & intersects(columns['truth_start'], columns['truth_end'],
+                                             columns['start'] - slack, columns['end'] + slack)
+    return mapped, positive, correct
+
+def count_above(mapq, mask):
+    # Element t is the number of masked reads with MAPQ > t, for every t at once
+    histogram = np.bincount(np.minimum(mapq[mask], MAX_MAPQ), minlength=MAX_MAPQ + 1)
+    return histogram.sum() - np.cumsum(histogram)
+
+def threshold_counts(columns):
+    mapped, positive, correct = classify_reads(columns)
+    return {
+        'TP': count_above(columns['mapq'], mapped & positive),
+        'FP': count_above(columns['mapq'], mapped & ~positive),
+        'correct': count_above(columns['mapq'], correct),
+        'TN': int(np.count_nonzero(~mapped & ~positive)),
+        'FN': int(np.count_nonzero(~mapped & positive)),
+    }
+
+def summarize(columns):
+    mapped, positive, correct = classify_reads(columns)
+    by_threshold = threshold_counts(columns)
+    return {'total': int(mapped.sum()), 'unmapped': int((~mapped).sum()),
+            'mapped': int((mapped & positive).sum()), 'correctmap': int(correct.sum()),
+            'numt': int((mapped & ~positive).sum()),
+            'TP': int((mapped & positive).sum()), 'FP': int((mapped & ~positive).sum()),
+            'TN': by_threshold['TN'], 'FN': by_threshold['FN'],
+            'TP_MQ30': int(by_threshold['TP'][30]), 'FP_MQ30': int(by_threshold['FP'][30]),
+            'TN_MQ30': by_threshold['TN'], 'FN_MQ30': by_threshold['FN'],
+            'reads': len(mapped), 'correctmap_MQ30': int(by_threshold['correct'][30]),
+            'numt_MQ30': int(by_threshold['FP'][30]),
+            'TP_by_mapq': by_threshold['TP'].tolist(), 'FP_by_mapq': by_threshold['FP'].tolist(),
+            'correct_by_mapq': by_threshold['correct'].tolist()}
+
+def evaluate_bam(bam_path, threads=1):
+    # threads are BGZF decompression threads for this file
+    return summarize(extract_columns(bam_path, threads))
+
+def print_stat_file(stats):
+    # Same layout as the alignments/*.stat files read by evaluate.py
+    print("True Positives (TP): "+str(stats['TP']))
+    print("False Positives (FP): "+str(stats['FP']))
+    print("True Negatives (TN): "+str(stats['TN']))
+    print("False Negatives (FN): "+str(stats['FN']))
+    print("")
+    print("For reads with MQ > 30:")
+    print("True Positives (TP_MQ30): "+str(stats['TP_MQ30']))
+    print("False Positives (FP_MQ30): "+str(stats['FP_MQ30']))
+    print("True Negatives (TN_MQ30): "+str(stats['TN_MQ30']))
+    print("False Negatives (FN_MQ30): "+str(stats['FN_MQ30']))
+
+def print_location_stat_file(stats):
+    # Layout of the l75 alignments/*.stat files, which count correctly placed reads
+    print("Total reads: "+str(stats['reads']))
+    print("-----------------------------------------")
+    print("Unmapped reads: "+str(stats['unmapped']))
+    print("Mapped to MT: "+str(stats['mapped']))
+    print("Mapped to MT (Correct Location): "+str(stats['correctmap']))
+    print("Mapped to MT (Correct Location, MQ>30): "+str(stats['correctmap_MQ30']))
+    print("NOT Mapped to MT: "+str(stats['numt']))
+    print("NOT Mapped to MT (MQ>30): "+str(stats['numt_MQ30']))
+
+def print_stats(stats):
+    total = stats['total']
+    mapped = stats['mapped']
+    print("Total:\t"+str(total))
+    print("unmapped:\t"+str(stats['unmapped']))
+    print("unmapped%:\t"+str(100*(stats['unmapped']/total)))
+    print("mapped:\t"+str(mapped))
+    print("mapped%:\t"+str(100*(mapped/total)))
+    print("correctmap:\t"+str(stats['correctmap']))
+    print("correctmap%:\t"+str(100*(stats['correctmap']/mapped)))
+    print("numt:\t"+str(stats['numt']))
+    print("numt%:\t"+str(100*(stats['numt']/total)))
+
+def expand_inputs(inputs):
+    # Each input may be a BAM, a directory of BAMs or a glob pattern
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(glob.glob(os.path.join(item, '*.bam')))
+        elif any(c in item for c in '*?['):
+            paths.extend(glob.glob(item))
+        else:
+            paths.append(item)
+    return sorted(set(paths))
+
+def evaluate_bams(bam_paths, workers, threads):
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(evaluate_bam, path, threads): path for path in bam_paths}
+        for done, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                print(f'Error processing {path}: {e}', file=sys.stderr)
+                continue
+            print(f'[{done}/{len(bam_paths)}] {os.path.basename(path)}', file=sys.stderr)
+    return results
+
+def write_table(results, output_path, columns=STAT_COLUMNS):
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['bam'] + columns)
+        for path in sorted(results):
+            writer.writerow([os.path.basename(path)] + [results[path][column] for column in columns])
+
+def write_threshold_table(results, output_path):
+    # Long format: TP/FP and correctly placed reads counted over reads with
+    # MAPQ > threshold; TN/FN do not depend on it
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['bam', 'mapq_threshold', 'TP', 'FP', 'TN', 'FN', 'correctmap'])
+        for path in sorted(results):
+            stats = results[path]
+            for threshold in range(MAX_MAPQ):
+                writer.writerow([os.path.basename(path), threshold, stats['TP_by_mapq'][threshold],
+                                 stats['FP_by_mapq'][threshold], stats['TN'], stats['FN'],
+                                 stats['correct_by_mapq'][threshold]])
 
+def main():
+    parser = argparse.ArgumentParser(description="Compute mapping statistics for one or more BAM files.")
+    parser.add_argument("inputs", nargs='+', help="BAM files, directories of BAMs or glob patterns")
+    parser.add_argument("-o", "--output", default=None, help="Consolidated per-BAM table (TSV); required for more than one BAM")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of BAMs processed in parallel")
+    parser.add_argument("-@", "--threads", type=int, default=1, help="BGZF decompression threads per BAM")
+    parser.add_argument("--thresholds", default=None, help="Also write TP/FP/TN/FN at every MAPQ threshold (TSV)")
+    parser.add_argument("--stat", action="store_true", help="For a single BAM, print the .stat layout chosen by --stat-layout")
+    parser.add_argument("--stat-layout", default="tp", choices=["tp", "location"],
+                        help="TP/FP/TN/FN counts (tp) or the correct location counts of the l75 sets (location)")
+    args = parser.parse_args()
 
+    bam_paths = expand_inputs(args.inputs)
+    if len(bam_paths) == 1 and args.output is None:
+        stats = evaluate_bam(bam_paths[0], args.threads)
+        if not args.stat:
+            print_stats(stats)
+        elif args.stat_layout == 'location':
+            print_location_stat_file(stats)
+        else:
+            print_stat_file(stats)
+        return
+    if args.output is None:
+        parser.error("--output is required when evaluating more than one BAM")
 
+    workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads)
+    results = evaluate_bams(bam_paths, workers, args.threads)
+    write_table(results, args.output)
+    if args.thresholds:
+        write_threshold_table(results, args.thresholds)
 
+if __name__ == "__main__":
+    main()
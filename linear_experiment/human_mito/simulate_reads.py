@@ -0,0 +1,268 @@
+#!/usr/bin/python
+
+import argparse
+import gzip
+import hashlib
+import os
+import re
+import numpy as np
+
+from damage_profile import load_reference, COMPLEMENT
+
+SUBSTITUTIONS = ['A>C', 'A>G', 'A>T', 'C>A', 'C>G', 'C>T', 'G>A', 'G>C', 'G>T', 'T>A', 'T>C', 'T>G']
+SEQ_LUT = np.frombuffer(b'ACGTN', dtype=np.uint8)
+# Per-cycle Phred qualities when no ART profile is given: a normal
+# distribution whose mean falls linearly over the read. It only approximates
+# ART's HS25 profile, so its error rates differ from the ART sets.
+QUALITY_START, QUALITY_END, QUALITY_SD = 37, 33, 3
+MIN_QUALITY, MAX_QUALITY, MAX_MERGED_QUALITY = 2, 41, 60
+
+def output_seed(seed, prefix):
+    # Independent, reproducible stream per output set of the Snakefile matrix
+    return int.from_bytes(hashlib.blake2b(f'{seed}:{os.path.basename(prefix)}'.encode(), digest_size=8).digest(), 'little')
+
+def load_matrix(path):
+    # deamSim/bam2prof matrix: a substitution header, then one row per position
+    # from the end; fields may carry an interval, e.g. '0.31 [0.30..0.32]'
+    rows = []
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if not line.strip() or 'A>C' in fields:
+                continue
+            rows.append([float(re.match(r'\s*([-+\d.eE]+)', field).group(1)) for field in fields[-12:]])
+    return np.array(rows).reshape(-1, 12)
+
+def load_damage(matfile):
+    # deamSim -matfile PREFIX reads PREFIX5.dat and PREFIX3.dat; 'none' means no damage
+    if matfile is None or os.path.basename(matfile) == 'none':
+        return None, None
+    return load_matrix(matfile + '5.dat'), load_matrix(matfile + '3.dat')
+
+def substitution_table(matrix5, matrix3, length):
+    # (length, 4, 4) probabilities of original base -> damaged base at every
+    # position, from the row of the nearer end (5' on ties). Positions past the
+    # last row of a matrix use its last row.
+    table = np.tile(np.eye(4), (length, 1, 1))
+    if matrix5 is None:
+        return table
+    positions = np.arange(length)
+    from_3p = length - 1 - positions
+    rows = np.where((positions <= from_3p)[:, None],
+                    matrix5[np.minimum(positions, len(matrix5) - 1)],
+                    matrix3[np.minimum(from_3p, len(matrix3) - 1)])
+    for column, substitution in enumerate(SUBSTITUTIONS):
+        table[:, 'ACGT'.index(substitution[0]), 'ACGT'.index(substitution[2])] = rows[:, column]
+    diagonal = np.arange(4)
+    table[:, diagonal, diagonal] = 0
+    table[:, diagonal, diagonal] = 1 - table.sum(axis=2)
+    return table
+
+class FragmentSource:
+    # Fixed-length fragments with a uniform start and strand, as fragSim -l
+    # draws them. Contigs named in `circular` wrap around their end; on the
+    # others only fragments that fit are drawn. Contigs are weighted by their
+    # number of possible starts.
+    def __init__(self, fasta_path, length, circular=()):
+        self.length = length
+        self.names, self.offsets, self.start_counts, sequences, offset = [], [], [], [], 0
+        for name, sequence in load_reference(fasta_path).items():
+            start_count = len(sequence) if name in circular else len(sequence) - length + 1
+            if start_count <= 0:
+                continue
+            if name in circular:
+                sequence = np.concatenate([sequence, np.resize(sequence, length - 1)])
+            self.names.append(name)
+            self.offsets.append(offset)
+            self.start_counts.append(start_count)
+            sequences.append(sequence)
+            offset += len(sequence)
+        if not sequences:
+            raise ValueError(f'No sequence in {fasta_path} is long enough for {length} bp fragments')
+        self.sequence = np.concatenate(sequences)
+        self.offsets = np.array(self.offsets)
+        self.start_counts = np.array(self.start_counts)
+        self.weights = self.start_counts / self.start_counts.sum()
+
+    def draw(self, count, rng):
+        # Fragments in molecule orientation: reverse-strand ones are reverse complemented
+        contigs = rng.choice(len(self.names), size=count, p=self.weights)
+        starts = (rng.random(count) * self.start_counts[contigs]).astype(np.int64)
+        fragments = self.sequence[(self.offsets[contigs] + starts)[:, None] + np.arange(self.length)]
+        reverse = rng.random(count) < 0.5
+        fragments[reverse] = COMPLEMENT[fragments[reverse, ::-1]]
+        return contigs, starts, reverse, fragments
+
+def deaminate(fragments, cdf, rng):
+    # Draw every base's damaged state at once from the cumulative table of its position
+    bases = np.minimum(fragments, 3)
+    cumulative = cdf[np.arange(fragments.shape[1]), bases]
+    damaged = np.minimum((rng.random(fragments.shape)[..., None] > cumulative).sum(axis=-1), 3).astype(np.uint8)
+    return np.where(fragments < 4, damaged, fragments)
+
+def load_quality_profile(path):
+    # ART empirical profile (e.g. Illumina_profiles/HiSeq2500L125R1.txt, which
+    # art_illumina -ss HS25 uses for read 1): per base symbol and cycle, a line
+    # of quality scores followed by a line of their cumulative counts. The
+    # combined ('.') lines give the per-cycle distribution, returned as
+    # (cycles, scores) arrays of qualities and cumulative probabilities.
+    qualities, counts = {}, {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 3 or fields[0] != '.':
+                continue
+            cycle = int(fields[1])
+            if cycle not in qualities:
+                qualities[cycle] = np.array(fields[2:], dtype=np.int64)
+            else:
+                counts[cycle] = np.array(fields[2:], dtype=float)
+    if not counts or sorted(counts) != list(range(len(counts))):
+        raise ValueError(f'{path} has no complete per-cycle quality distribution')
+    width = max(len(values) for values in qualities.values())
+    values = np.zeros((len(counts), width), dtype=np.int64)
+    cdf = np.ones((len(counts), width))
+    for cycle in range(len(counts)):
+        values[cycle] = np.pad(qualities[cycle], (0, width - len(qualities[cycle])), mode='edge')
+        cdf[cycle, :len(counts[cycle])] = counts[cycle] / counts[cycle][-1]
+    return values, cdf
+
+def draw_qualities(count, cycles, read_length, rng, profile=None):
+    # From the ART profile's distribution of each cycle (its last cycle past
+    # the end of the profile), or from the normal model without a profile
+    if profile is not None:
+        values, cdf = profile
+        rows = np.minimum(cycles, len(values) - 1)
+        index = (rng.random((count, len(cycles)))[..., None] >= cdf[rows]).sum(axis=-1)
+        return values[rows, np.minimum(index, values.shape[1] - 1)]
+    means = np.linspace(QUALITY_START, QUALITY_END, read_length)[cycles]
+    qualities = np.rint(rng.normal(means, QUALITY_SD, size=(count, len(cycles))))
+    return np.clip(qualities, MIN_QUALITY, MAX_QUALITY).astype(np.int64)
+
+def sequencing_errors(bases, qualities, rng):
+    # A base is miscalled with probability 10^(-Q/10), as one of the three other bases
+    error = (rng.random(bases.shape) < 10.0 ** (-qualities / 10)) & (bases < 4)
+    miscalled = ((bases.astype(np.int64) + rng.integers(1, 4, size=bases.shape)) % 4).astype(np.uint8)
+    return np.where(error, miscalled, bases)
+
+def merged_reads(fragments, read_length, rng, profiles=(None, None)):
+    # Both mates cover the insert, adapters follow it, and leeHom trims them
+    # at the overlap and merges the pair. Each mate is sequenced with its own
+    # errors over the bases it covers, in fragment coordinates. Where both
+    # cover a base, agreeing calls add their qualities, and disagreeing calls
+    # keep the better base at the quality difference.
+    count, length = fragments.shape
+    positions = np.arange(length)
+    covered1 = positions < read_length
+    covered2 = length - 1 - positions < read_length
+    quality1 = np.zeros((count, length), dtype=np.int64)
+    quality2 = np.zeros((count, length), dtype=np.int64)
+    quality1[:, covered1] = draw_qualities(count, positions[covered1], read_length, rng, profiles[0])
+    quality2[:, covered2] = draw_qualities(count, length - 1 - positions[covered2], read_length, rng, profiles[1])
+    read1 = sequencing_errors(fragments, np.where(covered1, quality1, 1000), rng)
+    read2 = sequencing_errors(fragments, np.where(covered2, quality2, 1000), rng)
+
+    both = covered1 & covered2
+    first_better = quality1 >= quality2
+    bases = np.where(covered1, read1, read2)
+    bases = np.where(both & ~first_better, read2, bases)
+    qualities = np.where(covered1, quality1, quality2)
+    agree = read1 == read2
+    qualities = np.where(both & agree, np.minimum(quality1 + quality2, MAX_MERGED_QUALITY), qualities)
+    qualities = np.where(both & ~agree, np.maximum(np.abs(quality1 - quality2), MIN_QUALITY), qualities)
+    return bases, qualities
+
+def paired_reads(fragments, read_length, rng, profiles=(None, None)):
+    # Inserts too long to merge: read 1 from the 5' end, read 2 from the 3' end of the other strand
+    count = len(fragments)
+    cycles = np.arange(read_length)
+    read1 = fragments[:, :read_length]
+    read2 = COMPLEMENT[fragments[:, ::-1][:, :read_length]]
+    quality1 = draw_qualities(count, cycles, read_length, rng, profiles[0])
+    quality2 = draw_qualities(count, cycles, read_length, rng, profiles[1])
+    return (sequencing_errors(read1, quality1, rng), quality1), (sequencing_errors(read2, quality2, rng), quality2)
+
+def fastq_records(names, bases, qualities):
+    sequences = SEQ_LUT[bases]
+    quality_strings = (qualities + 33).astype(np.uint8)
+    return [b'@' + name + b'\n' + sequence.tobytes() + b'\n+\n' + quality.tobytes() + b'\n'
+            for name, sequence, quality in zip(names, sequences, quality_strings)]
+
+def fragment_names(source, contigs, starts, reverse):
+    # fragSim naming, <contig>:<strand>:<start>:<end>:<length>, which parseBamMito reads the truth from
+    length = source.length
+    return [f'{source.names[contig]}:{"-" if rev else "+"}:{start}:{start + length}:{length}'.encode()
+            for contig, start, rev in zip(contigs, starts, reverse)]
+
+def simulate(fasta_path, prefix, nfrags, length, matfile=None, circular=(), rates=(), read_length=125,
+             min_overlap=11, seed=1, sample_seed=321, quality_profiles=(), batch_size=1 << 12, compresslevel=6):
+    # One streaming pass from fragments to the merged (<prefix>_o.fq.gz) and
+    # unmerged (<prefix>_o_r1/_o_r2.fq.gz) reads. It also writes every
+    # subsampled copy (<prefix>_o_s<rate>.fq.gz, ...). Each record gets one
+    # uniform draw from the sampling stream and is kept at every rate above it.
+    # Rates are therefore nested, as with repeated seqtk sample -s runs, and
+    # the two mates of a pair share their draw.
+    rng = np.random.default_rng(output_seed(seed, prefix))
+    sample_rngs = {'merged': np.random.default_rng(sample_seed), 'paired': np.random.default_rng(sample_seed + 1)}
+    source = FragmentSource(fasta_path, length, circular)
+    cdf = np.cumsum(substitution_table(*load_damage(matfile), length), axis=2)
+    merge = length <= 2 * read_length - min_overlap
+    # Read 2 uses read 1's profile unless it has its own
+    profiles = [load_quality_profile(path) for path in quality_profiles]
+    profiles = (profiles + profiles)[:2] if profiles else (None, None)
+
+    suffixes = {'merged': ['_o'], 'paired': ['_o_r1', '_o_r2']}
+    outputs = {}
+    for stream, names in suffixes.items():
+        for rate in [None] + list(rates):
+            rate_suffix = '' if rate is None else f'_s{rate}'
+            outputs[stream, rate] = [gzip.open(f'{prefix}{name}{rate_suffix}.fq.gz.tmp', 'wb', compresslevel=compresslevel)
+                                     for name in names]
+
+    for batch_start in range(0, nfrags, batch_size):
+        count = min(batch_size, nfrags - batch_start)
+        contigs, starts, reverse, fragments = source.draw(count, rng)
+        fragments = deaminate(fragments, cdf, rng)
+        names = fragment_names(source, contigs, starts, reverse)
+        if merge:
+            stream = 'merged'
+            records = [fastq_records(names, *merged_reads(fragments, read_length, rng, profiles))]
+        else:
+            stream = 'paired'
+            mate1, mate2 = paired_reads(fragments, read_length, rng, profiles)
+            records = [fastq_records([name + b'/1' for name in names], *mate1),
+                       fastq_records([name + b'/2' for name in names], *mate2)]
+        draws = sample_rngs[stream].random(count)
+        for rate in [None] + list(rates):
+            keep = np.arange(count) if rate is None else np.flatnonzero(draws < float(rate))
+            for handle, mate_records in zip(outputs[stream, rate], records):
+                handle.write(b''.join(mate_records[k] for k in keep))
+
+    for (stream, rate), handles in outputs.items():
+        rate_suffix = '' if rate is None else f'_s{rate}'
+        for name, handle in zip(suffixes[stream], handles):
+            handle.close()
+            os.replace(f'{prefix}{name}{rate_suffix}.fq.gz.tmp', f'{prefix}{name}{rate_suffix}.fq.gz')
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate damaged, merged/paired aDNA reads and their subsamples in one pass (fragSim | deamSim | adptSim | ART | leeHom | seqtk sample).")
+    parser.add_argument("fasta", help="Reference to draw fragments from")
+    parser.add_argument("-o", "--prefix", required=True, help="Output prefix, e.g. simulations/gen_0_n4000_l50_ddhigh")
+    parser.add_argument("-n", "--nfrags", type=int, required=True, help="Number of fragments")
+    parser.add_argument("-l", "--length", type=int, required=True, help="Fragment length")
+    parser.add_argument("--circ", nargs='*', default=[], help="Circular contigs")
+    parser.add_argument("--matfile", default=None, help="Damage matrix prefix (PREFIX5.dat/PREFIX3.dat); 'none' or unset for no damage")
+    parser.add_argument("--rates", nargs='*', default=[], help="Subsampling rates written next to the full output")
+    parser.add_argument("--read-length", type=int, default=125, help="Sequencing read length")
+    parser.add_argument("--min-overlap", type=int, default=11, help="Shortest mate overlap that is still merged")
+    parser.add_argument("--seed", type=int, default=1, help="Base seed; each output prefix derives its own")
+    parser.add_argument("--sample-seed", type=int, default=321, help="Seed of the subsampling draws")
+    parser.add_argument("--quality-profile", nargs='+', default=[], metavar="PROFILE",
+                        help="ART empirical quality profile for read 1 and optionally read 2 (e.g. HiSeq2500L125R1.txt HiSeq2500L125R2.txt for HS25); without one, qualities come from a normal model not comparable to the ART sets")
+    args = parser.parse_args()
+
+    simulate(args.fasta, args.prefix, args.nfrags, args.length, args.matfile, set(args.circ), args.rates,
+             args.read_length, args.min_overlap, args.seed, args.sample_seed, args.quality_profile[:2])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import os
+import re
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+from hc_results.npz_table import save_table, load_table
+
+# Every table shares these index columns; fields that do not apply to a table
+# are left as '' (strings), -1 (integers) or NaN (rates). rate_label keeps the
+# rate as spelled in the file name, since s0.1 and s0.10 parse to the same rate.
+INDEX_COLUMNS = ['aligner', 'damage', 'length', 'rate', 'replicate']
+
+LINEAR_NAME = re.compile(r'n(?P<nfrags>\d+)(?:_l(?P<length>\d+))?_d(?P<damage>[^_]+)_s(?P<rate>[\d.]+)(?:_(?P<aligner>\w+))?$')
+HAPLOCART_NAME = re.compile(r'^(?P<sample>[^._]+).*?_(?P<rate>[\d.]+)x(?:_replicate_(?P<replicate>\d+))?\.(?P<correction>\w+)\.log$')
+SUBSTITUTIONS = ['A>C', 'A>G', 'A>T', 'C>A', 'C>G', 'C>T', 'G>A', 'G>C', 'G>T', 'T>A', 'T>C', 'T>G']
+
+def parse_linear_name(stem):
+    match = LINEAR_NAME.search(stem)
+    if match is None:
+        raise ValueError(f'Unexpected file name format: {stem}')
+    fields = match.groupdict()
+    return {'aligner': fields['aligner'] or '', 'damage': fields['damage'],
+            'length': int(fields['length']) if fields['length'] else -1,
+            'rate': float(fields['rate']), 'replicate': -1, 'nfrags': int(fields['nfrags']), 'rate_label': fields['rate']}
+
+def stat_key(key):
+    # 'True Positives (TP_MQ30)' -> 'TP_MQ30'; 'Mapped to MT (Correct Location)' -> 'mapped_to_mt_correct_location'
+    match = re.search(r'\(([A-Z]+(?:_MQ30)?)\)$', key)
+    if match:
+        return match.group(1)
+    return re.sub(r'[^a-z0-9]+', '_', key.lower()).strip('_').replace('mq_30', 'mq30')
+
+def ingest_stats(directory):
+    rows = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.stat'))):
+        row = parse_linear_name(os.path.basename(path)[:-len('.stat')])
+        with open(path) as f:
+            for line in f:
+                key, sep, value = line.rpartition(':')
+                if sep and value.strip().isdigit():
+                    row[stat_key(key.strip())] = int(value)
+        rows.append(row)
+    frame = pd.DataFrame(rows)
+    # The two .stat layouts have different counters; missing ones become -1, not NaN
+    counts = [column for column in frame.columns if column not in INDEX_COLUMNS + ['nfrags', 'rate_label']]
+    frame[counts] = frame[counts].fillna(-1).astype(np.int64)
+    return frame
+
+def parse_prof(path):
+    # bam2prof -both: a 5' table followed by a 3' table, each with a header line
+    with open(path) as f:
+        lines = [line for line in f if line.strip()]
+    headers = [i for i, line in enumerate(lines) if line.startswith('A>C')] + [len(lines)]
+    tables = []
+    for start, end in zip(headers, headers[1:]):
+        tables.append(np.array([line.split('\t')[:12] for line in lines[start + 1:end]], dtype=float).reshape(-1, 12))
+    return tables
+
+def ingest_profiles(directory):
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.prof'))):
+        meta = parse_linear_name(os.path.basename(path)[:-len('.prof')])
+        for end, table in zip(('5p', '3p'), parse_prof(path)):
+            frame = pd.DataFrame(table, columns=SUBSTITUTIONS)
+            frame.insert(0, 'position', np.arange(len(table)))
+            frame.insert(0, 'end', end)
+            for column, value in reversed(list(meta.items())):
+                frame.insert(0, column, value)
+            frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def ingest_benchmarks(directory):
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.tsv'))):
+        name = os.path.basename(path)[:-len('.tsv')]
+        meta = parse_linear_name(name)
+        meta['aligner'] = name.split('_')[0]
+        frame = pd.read_csv(path, sep='\t').drop(columns=['h:m:s'], errors='ignore')
+        frame.insert(0, 'run', np.arange(len(frame)))
+        for column, value in reversed(list(meta.items())):
+            frame.insert(0, column, value)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def ingest_haplocart(directory):
+    rows = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.log'))):
+        match = HAPLOCART_NAME.match(os.path.basename(path))
+        if match is None:
+            continue
+        haplogroup, reads = '', -1
+        with open(path) as f:
+            for line in f:
+                if line.startswith('stdin'):
+                    parts = line.split()
+                    haplogroup, reads = parts[1], int(parts[2])
+        rows.append({'aligner': '', 'damage': '', 'length': -1, 'rate': float(match.group('rate')),
+                     'replicate': int(match.group('replicate') or 1), 'rate_label': match.group('rate'), 'sample': match.group('sample'),
+                     'correction': match.group('correction'), 'haplogroup': haplogroup, 'reads': reads})
+    return pd.DataFrame(rows)
+
+def ingest_euka(directory):
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, 'euka_*_abundance.tsv'))):
+        correction = os.path.basename(path).split('_')[1]
+        # Detected taxa carry a trailing tab, so the header is replaced and only 8 fields kept
+        frame = pd.read_csv(path, sep='\t', header=None, skiprows=1, usecols=range(8),
+                            names=['taxa', 'detected', 'reads', 'proportion', 'ci85_low', 'ci85_high', 'ci95_low', 'ci95_high'])
+        frame.insert(0, 'correction', correction)
+        for column, value in reversed(list(zip(INDEX_COLUMNS + ['rate_label'], ['', '', -1, np.nan, -1, '']))):
+            frame.insert(0, column, value)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def ingest_alignment_summary(csv_path):
+    frame = pd.read_csv(csv_path, dtype={'Subsampling_Rate': str})
+    frame.insert(frame.columns.get_loc('Subsampling_Rate') + 1, 'rate_label', frame['Subsampling_Rate'])
+    frame['Subsampling_Rate'] = frame['Subsampling_Rate'].astype(float)
+    frame = frame.rename(columns={'Damage_Type': 'damage', 'Aligner_Name': 'aligner',
+                                  'Sequence Length': 'length', 'Subsampling_Rate': 'rate'})
+    frame.insert(len(INDEX_COLUMNS) - 1, 'replicate', -1)
+    return frame
+
+def report_rate_collisions(table, frame):
+    # Flag index keys reached from differently spelled rates (e.g. s0.1 and
+    # s0.10); they stay apart only through rate_label
+    if 'rate_label' not in frame.columns:
+        return
+    spellings = frame.groupby(INDEX_COLUMNS, dropna=False)['rate_label'].unique()
+    for key, labels in spellings[spellings.map(len) > 1].items():
+        print(f'{table}: rate spelled as {", ".join(sorted(labels))} for {dict(zip(INDEX_COLUMNS, key))}; filter on rate_label to tell them apart')
+
+def ingest(root, store_path):
+    human_mito = os.path.join(root, 'linear_experiment', 'human_mito')
+    sources = {
+        'stats': lambda: ingest_stats(os.path.join(human_mito, 'alignments')),
+        'damage_profiles': lambda: ingest_profiles(os.path.join(human_mito, 'alignments', 'profs')),
+        'benchmarks': lambda: ingest_benchmarks(os.path.join(human_mito, 'benchmarks')),
+        'alignment_summary': lambda: ingest_alignment_summary(os.path.join(human_mito, 'alignment_stats.csv')),
+        'haplocart': lambda: ingest_haplocart(os.path.join(root, 'hc_results')),
+        'euka': lambda: ingest_euka(os.path.join(root, 'euka_results')),
+    }
+    os.makedirs(store_path, exist_ok=True)
+    for table, load in sources.items():
+        frame = load()
+        if frame.empty:
+            print(f'{table}: no source files found')
+            continue
+        frame = frame.sort_values(INDEX_COLUMNS, kind='stable').reset_index(drop=True)
+        report_rate_collisions(table, frame)
+        save_table(frame, os.path.join(store_path, table + '.npz'))
+        print(f'{table}: {len(frame)} rows')
+
+class ResultsStore:
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.frames = {}
+
+    def tables(self):
+        return sorted(name[:-len('.npz')] for name in os.listdir(self.store_path) if name.endswith('.npz'))
+
+    def table(self, name):
+        if name not in self.frames:
+            self.frames[name] = load_table(os.path.join(self.store_path, name + '.npz'))
+        return self.frames[name]
+
+    def query(self, name, **filters):
+        # Each filter is a value or a list of accepted values, e.g.
+        # store.query('stats', aligner=['safari', 'giraffe'], damage='dhigh')
+        frame = self.table(name)
+        mask = np.ones(len(frame), dtype=bool)
+        for column, value in filters.items():
+            accepted = value if isinstance(value, (list, tuple, set)) else [value]
+            mask &= frame[column].isin(accepted).to_numpy()
+        return frame[mask].reset_index(drop=True)
+
+def parse_filter(text):
+    column, _, value = text.partition('=')
+    if column.endswith('_label'):
+        return column, value.split(',')
+    values = []
+    for item in value.split(','):
+        try:
+            values.append(float(item) if '.' in item else int(item))
+        except ValueError:
+            values.append(item)
+    return column, values
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest experiment outputs into a columnar store and query it.")
+    parser.add_argument("--store", default="results_store", help="Directory holding the .npz tables")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest", help="(Re)build the store from the raw result files")
+    ingest_parser.add_argument("--root", default=".", help="Repository root")
+    query_parser = subparsers.add_parser("query", help="Print the rows of a table matching column=value[,value...] filters")
+    query_parser.add_argument("table")
+    query_parser.add_argument("filters", nargs='*')
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        ingest(args.root, args.store)
+    else:
+        pd.set_option('display.width', None)
+        print(ResultsStore(args.store).query(args.table, **dict(parse_filter(f) for f in args.filters)).to_string(index=False))
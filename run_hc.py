@@ -0,0 +1,153 @@
+import argparse
+import collections
+import glob
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+# Same pipeline as run_hc.sh; {vgan} is the binary of the corrected or uncorrected build
+DEFAULT_COMMAND = ("samtools bam2fq {bam} | {vgan} haplocart -np -t {threads} -fq1 /dev/stdin "
+                   "--hc-files /home/projects/MAAG/Magpie/Magpie/vgan_corrected/share/vgan/hcfiles")
+VARIANTS = ['corrected', 'uncorrected']
+
+def log_complete(log_path, block_size=4096):
+    # A finished HaploCart log ends with the '#sample' result block
+    try:
+        with open(log_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - block_size))
+            return b'#sample' in f.read()
+    except OSError:
+        return False
+
+def log_name(base_name, rate, variant):
+    # Every rate directory holds the same <sample>_replicate_<n>.bam names, so
+    # the rate goes into the log name (<sample>_<rate>_replicate_<n>) unless
+    # the BAM name already carries it
+    if f'_{rate}' not in base_name:
+        head, sep, replicate = base_name.rpartition('_replicate_')
+        base_name = f'{head}_{rate}{sep}{replicate}' if sep else f'{base_name}_{rate}'
+    return f'{base_name}.{variant}.log'
+
+def build_jobs(bam_dir, rates, variants, log_dir):
+    # One job per (BAM, rate, binary); the cost estimate is the BAM size
+    jobs = []
+    for rate in rates:
+        for bam in sorted(glob.glob(os.path.join(bam_dir, rate, '*.bam'))):
+            base_name = os.path.basename(bam)[:-len('.bam')]
+            for variant in variants:
+                jobs.append({'bam': bam, 'rate': rate, 'variant': variant, 'cost': os.path.getsize(bam),
+                             'log': os.path.join(log_dir, log_name(base_name, rate, variant))})
+    return jobs
+
+class WorkStealingQueue:
+    # One deque per worker, seeded largest-first onto the least loaded worker.
+    # A worker takes from the front of its own deque (its largest job) and,
+    # once empty, steals from the back of the deque with the most queued cost,
+    # so the small jobs fill the tail instead of leaving cores idle.
+    def __init__(self, jobs, workers):
+        self.lock = threading.Lock()
+        self.deques = [collections.deque() for _ in range(workers)]
+        self.loads = [0] * workers
+        for job in sorted(jobs, key=lambda job: job['cost'], reverse=True):
+            worker = self.loads.index(min(self.loads))
+            self.deques[worker].append(job)
+            self.loads[worker] += job['cost']
+
+    def take(self, worker):
+        with self.lock:
+            if self.deques[worker]:
+                job = self.deques[worker].popleft()
+                self.loads[worker] -= job['cost']
+                return job
+            victim = self.loads.index(max(self.loads))
+            if not self.deques[victim]:
+                return None
+            job = self.deques[victim].pop()
+            self.loads[victim] -= job['cost']
+            return job
+
+def run_job(job, command_template, threads, niceness):
+    # Output goes to a temporary log that replaces the final one only on
+    # success, so reruns never append to an old log. wait4 gives the CPU time
+    # and peak RSS of this job's process tree alone, even with other jobs running.
+    # The whole pipeline runs under nice; preexec_fn is not safe with threads.
+    command = command_template.format(bam=job['bam'], vgan=f'./vgan_{job["variant"]}/bin/vgan',
+                                      threads=threads, rate=job['rate'], variant=job['variant'])
+    if niceness:
+        command = f'nice -n {niceness} sh -c {shlex.quote(command)}'
+    tmp_path = job['log'] + '.tmp'
+    start = time.perf_counter()
+    with open(tmp_path, 'w') as log:
+        process = subprocess.Popen(command, shell=True, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if process.returncode == 0:
+        os.replace(tmp_path, job['log'])
+    return {'bam': os.path.basename(job['bam']), 'rate': job['rate'], 'variant': job['variant'],
+            'cost': job['cost'], 'threads': threads, 's': elapsed, 'cpu_time': usage.ru_utime + usage.ru_stime,
+            'max_rss': usage.ru_maxrss / 1024, 'returncode': process.returncode, 'time': time.time()}
+
+def schedule(jobs, cores, threads_per_job, command_template, record_path, niceness=19):
+    workers = max(1, min(len(jobs), cores // threads_per_job))
+    queue = WorkStealingQueue(jobs, workers)
+    lock = threading.Lock()
+    records = []
+
+    def worker(index):
+        while True:
+            job = queue.take(index)
+            if job is None:
+                return
+            try:
+                record = run_job(job, command_template, threads_per_job, niceness)
+            except Exception as e:
+                # Recorded as a failed job so the run still exits non-zero
+                record = {'bam': os.path.basename(job['bam']), 'rate': job['rate'], 'variant': job['variant'],
+                          'cost': job['cost'], 'threads': threads_per_job, 's': 0.0, 'cpu_time': 0.0,
+                          'max_rss': 0.0, 'returncode': -1, 'error': repr(e), 'time': time.time()}
+            with lock:
+                records.append(record)
+                with open(record_path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+                status = '' if record['returncode'] == 0 else f' ({record.get("error", "exit " + str(record["returncode"]))})'
+                print(f'[{len(records)}/{len(jobs)}] {record["bam"]} {record["variant"]}: '
+                      f'{record["s"]:.1f} s, {record["max_rss"]:.0f} MB{status}', file=sys.stderr)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description="Run HaploCart over the subsampled BAMs with both vgan builds on a fixed core budget.")
+    parser.add_argument("--bam-dir", default="/home/projects/MAAG/Magpie/Magpie/haplocart_ancient/subsampled_reps", help="Directory with one subdirectory of BAMs per rate")
+    parser.add_argument("--rates", nargs='+', default=["0.25x", "0.5x", "1x", "2x"], help="Rate subdirectories to run")
+    parser.add_argument("--variants", nargs='+', default=VARIANTS, choices=VARIANTS, help="vgan builds to run")
+    parser.add_argument("--log-dir", default="hc_results", help="Directory for the HaploCart logs")
+    parser.add_argument("--cores", type=int, default=60, help="Total core budget")
+    parser.add_argument("--threads-per-job", type=int, default=4, help="HaploCart threads per job")
+    parser.add_argument("--command", default=DEFAULT_COMMAND, help="Command template; {bam}, {vgan}, {threads}, {rate} and {variant} are filled in")
+    parser.add_argument("--records", default=None, help="Per-job wall time/RSS records (default: <log-dir>/jobs.jsonl)")
+    parser.add_argument("--niceness", type=int, default=19, help="Niceness of the jobs, 0 to disable")
+    parser.add_argument("--force", action="store_true", help="Rerun jobs whose log is already complete")
+    args = parser.parse_args()
+
+    os.makedirs(args.log_dir, exist_ok=True)
+    jobs = build_jobs(args.bam_dir, args.rates, args.variants, args.log_dir)
+    pending = [job for job in jobs if args.force or not log_complete(job['log'])]
+    print(f'{len(jobs)} jobs, {len(jobs) - len(pending)} already complete', file=sys.stderr)
+    records = schedule(pending, args.cores, args.threads_per_job, args.command,
+                       args.records or os.path.join(args.log_dir, 'jobs.jsonl'), args.niceness)
+    if len(records) < len(pending) or any(record['returncode'] != 0 for record in records):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,45 @@
 import random
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from bisect import bisect_right
 from collections import defaultdict
 import matplotlib.pyplot as plt
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from scipy.optimize import curve_fit
 import gzip
+import hashlib
+import json
+import mmap
 from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+import argparse
 import os
 
 # Create complement mapping outside of the function
 COMPLEMENT = str.maketrans('ACTGNRY', 'TGACNYR')
 
-# Add this function to read sequences from a gzipped FASTQ file
-def read_fastq(file_path: str) -> List[str]:
+# Stream (name, sequence) records from a gzipped FASTQ file in chunks
+def iter_fastq_chunks(file_path: str, chunk_size: int = 100000):
     with gzip.open(file_path, 'rt') as f:
-        sequences = []
+        chunk = []
         while True:
-            f.readline()  # skip the name line
-            seq = f.readline().strip()  # get the sequence line
-            if not seq:
+            name = f.readline().strip()  # get the name line
+            if not name:
                 break
+            seq = f.readline().strip()  # get the sequence line
             f.readline()  # skip the plus line
             f.readline()  # skip the quality line
-            sequences.append(seq.upper())
-    return sequences
+            chunk.append((name[1:].split()[0], seq.upper()))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+# Add this function to read sequences from a gzipped FASTQ file
+def read_fastq(file_path: str) -> List[str]:
+    return [seq for chunk in iter_fastq_chunks(file_path) for _, seq in chunk]
 
 # Functions for reading and preprocessing
 def read_fasta(file_path: str) -> str:
@@ -31,6 +47,106 @@ def read_fasta(file_path: str) -> str:
         sequence = ''.join(line.strip() for line in f if not line.startswith('>'))
     return sequence.upper()
 
+# Record-aware FASTA access through a samtools-style .fai index. Uncompressed
+# files are memory-mapped and each record is exposed as a FastaRecord that
+# slices straight out of the mapping, so k-mers never span two records and
+# only the requested bases are ever copied.
+UPPERCASE = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz', b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+def build_fai(file_path: str) -> List[Tuple[str, int, int, int, int]]:
+    records = []
+    with open(file_path, 'rb') as f:
+        offset = 0
+        name = None
+        for line in f:
+            if line.startswith(b'>'):
+                if name is not None:
+                    records.append((name, length, seq_offset, line_bases, line_width))
+                name = line[1:].split()[0].decode('ascii')
+                length, seq_offset, line_bases, line_width = 0, offset + len(line), 0, 0
+            elif name is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                if line_bases == 0:
+                    line_bases, line_width = bases, len(line)
+                length += bases
+            offset += len(line)
+        if name is not None:
+            records.append((name, length, seq_offset, line_bases, line_width))
+    return records
+
+def read_fai(file_path: str) -> List[Tuple[str, int, int, int, int]]:
+    fai_path = file_path + '.fai'
+    if os.path.exists(fai_path) and os.path.getmtime(fai_path) >= os.path.getmtime(file_path):
+        with open(fai_path) as f:
+            return [(name, int(length), int(offset), int(line_bases), int(line_width))
+                    for name, length, offset, line_bases, line_width in (line.split('\t')[:5] for line in f if line.strip())]
+
+    records = build_fai(file_path)
+    try:
+        with open(fai_path, 'w') as f:
+            for record in records:
+                f.write('\t'.join(map(str, record)) + '\n')
+    except OSError:
+        pass  # read-only location; keep the index in memory
+    return records
+
+class FastaRecord:
+    def __init__(self, data, name: str, length: int, offset: int, line_bases: int, line_width: int):
+        self.data = data
+        self.name = name
+        self.length = length
+        self.offset = offset
+        self.line_bases = max(1, line_bases)
+        self.line_width = max(1, line_width)
+
+    def __len__(self):
+        return self.length
+
+    def byte_offset(self, position: int) -> int:
+        return self.offset + (position // self.line_bases) * self.line_width + position % self.line_bases
+
+    def __getitem__(self, key: slice) -> str:
+        start, stop, _ = key.indices(self.length)
+        if start >= stop:
+            return ''
+        # bytes() copies only this window when data is a shared-memory view
+        raw = bytes(self.data[self.byte_offset(start):self.byte_offset(stop - 1) + 1])
+        return raw.translate(UPPERCASE, b'\r\n').decode('ascii')
+
+    def __str__(self):
+        return self[:]
+
+class FastaFile:
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(file_path) else b''
+        self.records = [FastaRecord(self.data, *record) for record in read_fai(file_path)]
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+def iter_fasta_records(file_path: str):
+    # Yields (name, sequence) one record at a time; gzipped files are streamed
+    if not file_path.endswith('.gz'):
+        for record in FastaFile(file_path):
+            yield record.name, str(record)
+        return
+    with gzip.open(file_path, 'rt') as f:
+        name, lines = None, []
+        for line in f:
+            if line.startswith('>'):
+                if name is not None:
+                    yield name, ''.join(lines).upper()
+                name, lines = line[1:].split()[0], []
+            else:
+                lines.append(line.strip())
+        if name is not None:
+            yield name, ''.join(lines).upper()
+
 def reverse_complement(seq: str) -> str:
     return seq.translate(COMPLEMENT)[::-1]
 
@@ -50,13 +166,172 @@ def create_index_table(sequence: str, k: int, w: int) -> Dict[str, List[int]]:
         table[minimizer].append(i)
     return table
 
-def process_kmer(args):
-    kmer, i, rymer_set, sequence, k = args
+# Vectorized index construction: every k-mer is packed into a uint64 using
+# `bits` bits per base (2 for ACGT, 1 for the RY alphabet), in the same order
+# as string comparison, so the smallest hash in a window is the minimizer.
+def encode_sequence(sequence: str, alphabet: str = 'ACGT') -> np.ndarray:
+    lut = np.full(256, -1, dtype=np.int8)
+    for rank, base in enumerate(alphabet):
+        lut[ord(base)] = rank
+    return lut[np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)]
+
+def kmer_hashes(codes: np.ndarray, k: int, bits: int):
+    n = len(codes) - k + 1
+    valid = codes >= 0
+    clean = np.where(valid, codes, 0).astype(np.uint64)
+    hashes = np.zeros(n, dtype=np.uint64)
+    shift = np.uint64(bits)
+    for j in range(k):
+        hashes = (hashes << shift) | clean[j:j + n]
+    # k-mers holding a base outside the alphabet (N, R, Y, ...) cannot be packed
+    invalid = np.concatenate(([0], np.cumsum(~valid)))
+    ambiguous = (invalid[k:] - invalid[:n]) > 0
+    return hashes, ambiguous
+
+def alphabet_bits(alphabet: str, k: int) -> int:
+    bits = max(1, (len(alphabet) - 1).bit_length())
+    if bits * k > 64:
+        raise ValueError(f'k={k} does not fit in 64 bits with a {len(alphabet)}-letter alphabet')
+    return bits
+
+def decode_kmers(hashes: np.ndarray, k: int, alphabet: str = 'ACGT') -> List[str]:
+    bits = alphabet_bits(alphabet, k)
+    shifts = np.arange(k - 1, -1, -1, dtype=np.uint64) * np.uint64(bits)
+    codes = (np.asarray(hashes, dtype=np.uint64)[:, None] >> shifts) & np.uint64((1 << bits) - 1)
+    text = np.frombuffer(alphabet.encode('ascii'), dtype=np.uint8)[codes].tobytes().decode('ascii')
+    return [text[i:i+k] for i in range(0, len(text), k)]
+
+def build_index_arrays(sequence: str, k: int, w: int, alphabet: str = 'ACGT', kmer_positions: bool = False):
+    # Returns the minimizer table in CSR form: sorted unique minimizer hashes,
+    # offsets into a position array holding each minimizer's windows in
+    # ascending order, and a dict for the few minimizers that cannot be packed.
+    # With kmer_positions the positions are the distinct start positions of
+    # the minimizer k-mers themselves, which is what read lookups compare against.
+    bits = alphabet_bits(alphabet, k)
+    extra = defaultdict(list)
+    num_windows = len(sequence) - w + 1
+    if num_windows <= 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64), extra
+
+    hashes, ambiguous = kmer_hashes(encode_sequence(sequence, alphabet), k, bits)
+    span = w - k + 1
+    starts = np.arange(num_windows) + np.argmin(sliding_window_view(hashes, span), axis=1)
+    minimizers = hashes[starts]
+
+    # Windows with ambiguous bases are rare; compare them as strings like create_index_table
+    packed = np.ones(num_windows, dtype=bool)
+    for i in np.flatnonzero(sliding_window_view(ambiguous, span).any(axis=1)).tolist():
+        minimizer = create_minimizer(sequence[i:i+w], k, w)
+        minimizer_hash, minimizer_ambiguous = kmer_hashes(encode_sequence(minimizer, alphabet), k, bits)
+        starts[i] = i + sequence[i:i+w].find(minimizer)
+        if minimizer_ambiguous[0]:
+            position = int(starts[i]) if kmer_positions else i
+            if not extra[minimizer] or extra[minimizer][-1] != position:
+                extra[minimizer].append(position)
+            packed[i] = False
+        else:
+            minimizers[i] = minimizer_hash[0]
+
+    # Group windows by minimizer hash; a stable sort keeps positions ascending
+    windows = np.flatnonzero(packed)
+    if kmer_positions:
+        windows = windows[np.unique(starts[windows], return_index=True)[1]]
+    windows = windows[np.argsort(minimizers[windows], kind='stable')]
+    positions = starts[windows] if kmer_positions else windows
+    grouped = minimizers[windows]
+    edges = np.flatnonzero(np.diff(grouped)) + 1
+    unique_hashes = grouped[np.concatenate(([0], edges))] if len(grouped) else grouped
+    offsets = np.concatenate(([0], edges, [len(positions)])).astype(np.int64)
+    return unique_hashes, offsets, positions.astype(np.int64), extra
+
+def create_index_table_fast(sequence: str, k: int, w: int, alphabet: str = 'ACGT') -> Dict[str, List[int]]:
+    hashes, offsets, positions, extra = build_index_arrays(sequence, k, w, alphabet)
+    table = defaultdict(list)
+    positions = positions.tolist()
+    offsets = offsets.tolist()
+    for key, lo, hi in zip(decode_kmers(hashes, k, alphabet), offsets, offsets[1:]):
+        table[key] = positions[lo:hi]
+    table.update(extra)
+    return table
+
+# On-disk minimizer index: the CSR arrays from build_index_arrays are stored
+# as .npy files keyed by the reference checksum, alphabet and (k, w), and
+# opened with mmap_mode so concurrent jobs share one copy via the page cache.
+class MinimizerIndex:
+    def __init__(self, hashes, offsets, positions, extra, k, alphabet='ACGT'):
+        self.hashes = hashes
+        self.offsets = offsets
+        self.positions = positions
+        self.extra = extra
+        self.k = k
+        self.alphabet = alphabet
+        self.bits = alphabet_bits(alphabet, k)
+
+    def __len__(self):
+        return len(self.hashes) + len(self.extra)
+
+    def find_hashes(self, query: np.ndarray) -> np.ndarray:
+        # Slot of each query hash in self.hashes, or -1 when absent
+        slots = np.searchsorted(self.hashes, query)
+        slots[slots == len(self.hashes)] = 0
+        found = len(self.hashes) > 0 and self.hashes[slots] == query
+        return np.where(found, slots, -1)
+
+    def slot(self, kmer: str) -> int:
+        # Slot of a packable k-mer, or -1 when it is absent, ambiguous or not k long
+        if len(kmer) != self.k:
+            return -1
+        hashes, ambiguous = kmer_hashes(encode_sequence(kmer, self.alphabet), self.k, self.bits)
+        if ambiguous[0]:
+            return -1
+        return int(self.find_hashes(hashes)[0])
+
+    def lookup(self, kmer: str) -> List[int]:
+        if kmer in self.extra:
+            return list(self.extra[kmer])
+        slot = self.slot(kmer)
+        if slot < 0:
+            return []
+        return self.positions[self.offsets[slot]:self.offsets[slot + 1]].tolist()
+
+    def __contains__(self, kmer: str) -> bool:
+        return bool(self.extra.get(kmer)) or self.slot(kmer) >= 0
+
+def sequence_checksum(sequence: str) -> str:
+    return hashlib.sha1(sequence.encode('ascii')).hexdigest()
+
+def load_or_build_index(sequence: str, k: int, w: int, alphabet: str, cache_dir: str, kmer_positions: bool = False) -> MinimizerIndex:
+    layout = '_kpos' if kmer_positions else ''
+    prefix = os.path.join(cache_dir, f"{sequence_checksum(sequence)}_{alphabet}_k{k}_w{w}{layout}")
+    names = ['hashes', 'offsets', 'positions']
+
+    # The .extra.json file is written last and marks a complete index
+    if not os.path.exists(prefix + '.extra.json'):
+        os.makedirs(cache_dir, exist_ok=True)
+        arrays = build_index_arrays(sequence, k, w, alphabet, kmer_positions)
+        suffix = f'.tmp{os.getpid()}'
+        for name, array in zip(names, arrays):
+            with open(f'{prefix}.{name}.npy{suffix}', 'wb') as f:
+                np.save(f, array)
+            os.replace(f'{prefix}.{name}.npy{suffix}', f'{prefix}.{name}.npy')
+        with open(prefix + '.extra.json' + suffix, 'w') as f:
+            json.dump(arrays[3], f)
+        os.replace(prefix + '.extra.json' + suffix, prefix + '.extra.json')
+
+    hashes, offsets, positions = (np.load(f'{prefix}.{name}.npy', mmap_mode='r') for name in names)
+    with open(prefix + '.extra.json') as f:
+        extra = json.load(f)
+    return MinimizerIndex(hashes, offsets, positions, extra, k, alphabet)
+
+def rymer_hit(kmer: str, rymer_set) -> bool:
     rymer = rymer_transform(kmer)
     rc_kmer = reverse_complement(kmer)
     rc_rymer = rymer_transform(rc_kmer)
+    return rymer in rymer_set or rc_rymer in rymer_set
 
-    rymer_found = rymer in rymer_set or rc_rymer in rymer_set
+def process_kmer(args):
+    kmer, i, rymer_set, sequence, k = args
+    rymer_found = rymer_hit(kmer, rymer_set)
 
     if rymer_found:
         ref_segment = sequence[i:i+k]
@@ -68,113 +343,378 @@ def process_kmer(args):
         return None, None
 
 def process_read(args):
-    read, k, w, minimizer_set, rymer_set, sequence = args
+    # Per-read reference implementation of process_read_chunk. rymer_table maps
+    # a RYmer to the start positions of that k-mer in the reference (an index
+    # built with kmer_positions=True); each hit is compared at those positions.
+    read, k, rymer_table, sequence = args
     mismatch_counts = []
     total_kmers = 0
     exact_matches = 0
 
     for i in range(len(read) - k + 1):
         kmer = read[i:i+k]
-        rymer = rymer_transform(kmer)
         rc_kmer = reverse_complement(kmer)
-        rc_rymer = rymer_transform(rc_rymer)
-
-        rymer_found = rymer in rymer_set or rc_rymer in rymer_set
 
-        if rymer_found:
-            ref_segment = sequence[i:i+k]
+        for query in (kmer, rc_kmer):
+            rymer = rymer_transform(query)
+            hits = rymer_table.lookup(rymer) if isinstance(rymer_table, MinimizerIndex) else rymer_table.get(rymer, [])
+            for position in hits:
+                ref_segment = sequence[position:position+k]
 
-            mismatch_count = sum((a == 'T' and b == 'C') or (a == 'A' and b == 'G') for a, b in zip(kmer, ref_segment))
-            mismatch_counts.append(mismatch_count)
-            total_kmers += 1
+                mismatch_count = sum((a == 'T' and b == 'C') or (a == 'A' and b == 'G') for a, b in zip(query, ref_segment))
+                mismatch_counts.append(mismatch_count)
+                total_kmers += 1
 
-            if kmer == ref_segment:
-                exact_matches += 1
+                if query == ref_segment:
+                    exact_matches += 1
 
     return mismatch_counts, exact_matches, total_kmers
 
-def find_deamination_mismatches(reads: List[str], k: int, w: int, minimizer_table: Dict[str, List[int]], rymer_table: Dict[str, List[int]], sequence: str) -> List[int]:
-    total_kmers = 0
-    exact_matches = 0
-    mismatch_counts = []
-
-    minimizer_set = set(minimizer_table.keys())
-    rymer_set = set(rymer_table.keys())
-
-    kmer_args = []
-
+# Batched deamination counting on 2-bit packed k-mers (A=00, C=01, G=10, T=11).
+# A base is a deamination-consistent mismatch (read T over C, or read A over G)
+# when the high bits differ, the low bits agree and the read base is A or T.
+LOW_BITS = np.uint64(0x5555555555555555)
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values).astype(np.int64)
+    as_bytes = np.ascontiguousarray(values, dtype=np.uint64).view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(as_bytes, axis=1).sum(axis=1).astype(np.int64)
+
+def pack_kmers(kmers: List[str], k: int):
+    codes = encode_sequence(''.join(kmers)).reshape(-1, k)
+    ambiguous = (codes < 0).any(axis=1)
+    shifts = np.arange(k - 1, -1, -1, dtype=np.uint64) * np.uint64(2)
+    packed = np.bitwise_or.reduce(np.where(codes < 0, 0, codes).astype(np.uint64) << shifts, axis=1)
+    return packed, ambiguous
+
+def deamination_kernel(query: np.ndarray, reference: np.ndarray, k: int):
+    mask = LOW_BITS & np.uint64((1 << (2 * k)) - 1)
+    one = np.uint64(1)
+    diff = query ^ reference
+    high_differs = (diff >> one) & mask
+    low_agrees = ~diff & mask
+    read_a_or_t = ~(query ^ (query >> one)) & mask
+    mismatch_counts = popcount64(high_differs & low_agrees & read_a_or_t)
+    return mismatch_counts, diff == 0
+
+def count_deamination_batch(kmers: List[str], ref_segments: List[str], k: int):
+    if not kmers:
+        return [], 0, 0
+    if k > 32:
+        raise ValueError(f'k={k} does not fit in a 2-bit packed uint64')
+
+    # Segments cut short by the reference end, or bases outside ACGT, take the per-character path
+    complete = np.array([len(segment) == k for segment in ref_segments])
+    padded = [segment if len(segment) == k else 'N' * k for segment in ref_segments]
+    query, query_ambiguous = pack_kmers(kmers, k)
+    reference, reference_ambiguous = pack_kmers(padded, k)
+    mismatch_counts, exact = deamination_kernel(query, reference, k)
+
+    for i in np.flatnonzero(query_ambiguous | reference_ambiguous | ~complete).tolist():
+        kmer, ref_segment = kmers[i], ref_segments[i]
+        mismatch_counts[i] = sum((a == 'T' and b == 'C') or (a == 'A' and b == 'G') for a, b in zip(kmer, ref_segment))
+        exact[i] = kmer == ref_segment
+
+    return mismatch_counts.tolist(), int(exact.sum()), len(kmers)
+
+def sample_kmer_positions(reads: List[str], k: int, fraction: float, rng: random.Random) -> List[Tuple[int, int]]:
+    # Draw (read index, offset) pairs directly from the range of k-mer start
+    # positions, so memory grows with the sample rather than the reference
+    offsets = [0]
     for read in reads:
-        for i in range(len(read) - k + 1):
-            kmer = read[i:i+k]
-            kmer_args.append((kmer, i, rymer_set, sequence, k))
-
-    # Subsample 0.1% of the kmers
-    subsample_size = max(1, int(0.01 * len(kmer_args)))
-    kmer_args_subsample = random.sample(kmer_args, subsample_size)
-
-    for args in kmer_args_subsample:
-        mc, em = process_kmer(args)
-        if mc is not None and em is not None:
-            mismatch_counts.append(mc)
-            total_kmers += 1
-            if em:
-                exact_matches += 1
-
-    return mismatch_counts, exact_matches, total_kmers
-
-def process_k(k):
+        offsets.append(offsets[-1] + max(0, len(read) - k + 1))
+    total = offsets[-1]
+    if total == 0:
+        return []
+
+    subsample_size = max(1, int(fraction * total))
+    positions = []
+    for index in sorted(rng.sample(range(total), subsample_size)):
+        read_index = bisect_right(offsets, index) - 1
+        positions.append((read_index, index - offsets[read_index]))
+    return positions
+
+def rymer_hits_batch(kmers: List[str], k: int, rymer_index: MinimizerIndex) -> np.ndarray:
+    # rymer_hit for many k-mers at once: the RYmers of both strands are packed
+    # (R=A=0, Y=C=1) and looked up with one searchsorted each. k-mers with a
+    # base outside ACGT take the per-k-mer path through the unpacked minimizers.
+    codes = encode_sequence(''.join(kmers)).reshape(-1, k)
+    ambiguous = (codes < 0).any(axis=1)
+    ry = np.where(codes >= 0, codes & 1, 0).astype(np.uint64)
+    shifts = np.arange(k - 1, -1, -1, dtype=np.uint64)
+    forward = np.bitwise_or.reduce(ry << shifts, axis=1)
+    # The reverse complement swaps R and Y and reverses the k-mer
+    reverse = np.bitwise_or.reduce((np.uint64(1) - ry[:, ::-1]) << shifts, axis=1)
+    hits = (rymer_index.find_hashes(forward) >= 0) | (rymer_index.find_hashes(reverse) >= 0)
+    for i in np.flatnonzero(ambiguous).tolist():
+        hits[i] = rymer_hit(kmers[i], rymer_index)
+    return hits
+
+def find_deamination_mismatches(reads: List[str], k: int, w: int, minimizer_table: Dict[str, List[int]], rymer_table: Dict[str, List[int]], sequence: str, sample_fraction: float = 0.01, rng: Optional[random.Random] = None) -> List[int]:
+    minimizer_set = minimizer_table if isinstance(minimizer_table, MinimizerIndex) else set(minimizer_table.keys())
+    rymer_set = rymer_table if isinstance(rymer_table, MinimizerIndex) else set(rymer_table.keys())
+
+    # Subsample 1% of the kmers, slicing only the sampled ones,
+    # and count the RYmer hits in one batch
+    rng = rng or random.Random()
+    positions = sample_kmer_positions(reads, k, sample_fraction, rng)
+    sampled = [reads[read_index][i:i+k] for read_index, i in positions]
+    if isinstance(rymer_set, MinimizerIndex) and sampled:
+        hits = rymer_hits_batch(sampled, k, rymer_set).tolist()
+    else:
+        hits = [rymer_hit(kmer, rymer_set) for kmer in sampled]
+    kmers = [kmer for kmer, hit in zip(sampled, hits) if hit]
+    ref_segments = [sequence[i:i+k] for (_, i), hit in zip(positions, hits) if hit]
+
+    return count_deamination_batch(kmers, ref_segments, k)
+
+# Read mode: stream real reads through a RYmer index of the reference. All
+# k-mers of a chunk, on both strands, are hashed at once and looked up with
+# searchsorted. Every hit is then compared to the reference k-mer at each
+# indexed position with the batched deamination kernel.
+READ_STATS_COLUMNS = ['read', 'kmers', 'rymer_hits', 'repetitive', 'hit_positions',
+                      'exact_hits', 'spurious_hits', 'deamination_mismatches']
+
+def expand_hits(index: MinimizerIndex, slots: np.ndarray):
+    # Positions for every slot, and the row of `slots` each one belongs to
+    counts = index.offsets[slots + 1] - index.offsets[slots]
+    rows = np.repeat(np.arange(len(slots)), counts)
+    firsts = np.cumsum(counts) - counts
+    entries = np.repeat(index.offsets[slots], counts) + np.arange(counts.sum()) - np.repeat(firsts, counts)
+    return np.asarray(index.positions[entries], dtype=np.int64), rows
+
+def process_read_chunk(reads: List[str], k: int, rymer_index: MinimizerIndex, reference: str, reference_hashes: np.ndarray, reference_ambiguous: np.ndarray, max_hits: int = 1000) -> Dict[str, np.ndarray]:
+    stats = {column: np.zeros(len(reads), dtype=np.int64) for column in READ_STATS_COLUMNS[1:]}
+    # '$' is outside the alphabet, so k-mers never span two reads
+    joined = '$'.join(reads)
+    if len(joined) < k:
+        return stats
+    read_starts = np.cumsum([0] + [len(read) + 1 for read in reads[:-1]])
+
+    codes = encode_sequence(joined)
+    rc_codes = np.where(codes >= 0, 3 - codes, -1)[::-1]
+    forward, ambiguous = kmer_hashes(codes, k, 2)
+    forward_ry, _ = kmer_hashes(np.where(codes >= 0, codes & 1, -1), k, 1)
+    reverse = kmer_hashes(rc_codes, k, 2)[0][::-1]
+    reverse_ry = kmer_hashes(np.where(rc_codes >= 0, rc_codes & 1, -1), k, 1)[0][::-1]
+
+    valid = np.flatnonzero(~ambiguous)
+    read_of_kmer = np.searchsorted(read_starts, valid, side='right') - 1
+    stats['kmers'] = np.array([max(0, len(read) - k + 1) for read in reads], dtype=np.int64)
+
+    found = np.zeros(len(valid), dtype=bool)
+    for query, query_ry in ((forward[valid], forward_ry[valid]), (reverse[valid], reverse_ry[valid])):
+        slots = rymer_index.find_hashes(query_ry)
+        found |= slots >= 0
+        counts = np.where(slots >= 0, rymer_index.offsets[slots + 1] - rymer_index.offsets[slots], 0)
+        repetitive = counts > max_hits
+        stats['repetitive'] += np.bincount(read_of_kmer[repetitive], minlength=len(reads))
+
+        compared = np.flatnonzero((slots >= 0) & ~repetitive)
+        positions, rows = expand_hits(rymer_index, slots[compared])
+        # reference_hashes packs N as A; reference windows holding N are skipped
+        clean = ~reference_ambiguous[positions]
+        positions, kmer_rows = positions[clean], compared[rows[clean]]
+        mismatch_counts, exact = deamination_kernel(query[kmer_rows], reference_hashes[positions], k)
+        pair_reads = read_of_kmer[kmer_rows]
+        stats['hit_positions'] += np.bincount(pair_reads, minlength=len(reads))
+        stats['exact_hits'] += np.bincount(pair_reads, weights=exact, minlength=len(reads)).astype(np.int64)
+        stats['deamination_mismatches'] += np.bincount(pair_reads, weights=mismatch_counts, minlength=len(reads)).astype(np.int64)
+
+    stats['rymer_hits'] = np.bincount(read_of_kmer[found], minlength=len(reads))
+
+    # k-mers with N can only hit the unpacked minimizers, e.g. around the rCRS N at 3107
+    if rymer_index.extra:
+        for j in np.flatnonzero(ambiguous).tolist():
+            kmer = joined[j:j+k]
+            if '$' in kmer:
+                continue
+            read_index = np.searchsorted(read_starts, j, side='right') - 1
+            mismatch_counts, exact_matches, total_kmers = process_read((kmer, k, rymer_index.extra, reference))
+            stats['rymer_hits'][read_index] += total_kmers > 0
+            stats['hit_positions'][read_index] += total_kmers
+            stats['exact_hits'][read_index] += exact_matches
+            stats['deamination_mismatches'][read_index] += sum(mismatch_counts)
+    stats['spurious_hits'] = stats['hit_positions'] - stats['exact_hits']
+    return stats
+
+def run_read_mode(fastq_path: str, reference: str, k: int, w: int, output_path: str, chunk_size: int = 100000, max_hits: int = 1000, cache_dir: Optional[str] = None):
+    ry_reference = rymer_transform(reference)
+    if cache_dir:
+        rymer_index = load_or_build_index(ry_reference, k, w, 'AC', cache_dir, kmer_positions=True)
+    else:
+        rymer_index = MinimizerIndex(*build_index_arrays(ry_reference, k, w, 'AC', kmer_positions=True), k, 'AC')
+    reference_hashes, reference_ambiguous = kmer_hashes(encode_sequence(reference), k, 2)
+
+    totals = defaultdict(int)
+    num_reads = 0
+    with open(output_path, 'w') as out:
+        out.write('\t'.join(READ_STATS_COLUMNS) + '\n')
+        for chunk in iter_fastq_chunks(fastq_path, chunk_size):
+            names = [name for name, _ in chunk]
+            stats = process_read_chunk([seq for _, seq in chunk], k, rymer_index, reference, reference_hashes, reference_ambiguous, max_hits)
+            columns = [stats[column].tolist() for column in READ_STATS_COLUMNS[1:]]
+            for name, row in zip(names, zip(*columns)):
+                out.write(name + '\t' + '\t'.join(map(str, row)) + '\n')
+            for column in READ_STATS_COLUMNS[1:]:
+                totals[column] += int(stats[column].sum())
+            num_reads += len(chunk)
+            print(f"processed {num_reads} reads")
+
+    hits = totals['hit_positions']
+    print(f"Reads: {num_reads}, k-mers: {totals['kmers']}, RYmer hits: {totals['rymer_hits']}")
+    print(f"Spurious hit fraction: {totals['spurious_hits'] / hits if hits else 0}")
+    print(f"Mean deamination mismatches per hit: {totals['deamination_mismatches'] / hits if hits else 0}")
+
+def process_k(k, seed=None, cache_dir=None):
     print("k= " +str(k))
     w = k + 2
-    minimizer_table = create_index_table(sequence, k, w)
-    rymer_table = create_index_table(rymer_transform(sequence), k, w)
-    mismatch_counts, exact_matches, total_kmers = find_deamination_mismatches([bacterial_reference], k, w, minimizer_table, rymer_table, sequence)
+    # Seed each k independently so results do not depend on worker scheduling
+    rng = random.Random(None if seed is None else f"{seed}:{k}")
+    # The whole reference is decoded only while the indexes are built; the
+    # sampled windows are then sliced from the shared block. Without a cache
+    # the array-backed indexes are built in memory, so RYmer lookups take the
+    # batched path either way.
+    reference = str(sequence)
+    if cache_dir:
+        minimizer_table = load_or_build_index(reference, k, w, 'ACGT', cache_dir)
+        rymer_table = load_or_build_index(rymer_transform(reference), k, w, 'AC', cache_dir)
+    else:
+        minimizer_table = MinimizerIndex(*build_index_arrays(reference, k, w), k)
+        rymer_table = MinimizerIndex(*build_index_arrays(rymer_transform(reference), k, w, 'AC'), k, 'AC')
+    del reference
+    mismatch_counts, exact_matches, total_kmers = find_deamination_mismatches(bacterial_records, k, w, minimizer_table, rymer_table, sequence, rng=rng)
     non_zero_mismatches = [count for count in mismatch_counts if count > 0]
     average_mismatch = sum(non_zero_mismatches) / len(non_zero_mismatches) if non_zero_mismatches else 0
     average_mismatch /= k
     exact_match_fraction = exact_matches / total_kmers if total_kmers else 0
     return average_mismatch, exact_match_fraction
 
-# Main code for generating the plot
-sequence = read_fasta("rCRS.fa")
-bacterial_reference = read_fasta("refSoilSmall.fa")
-
-k_values = list(range(3, 31))
-results = []
-
-with ProcessPoolExecutor(max_workers=1) as executor:
-    results = list(executor.map(process_k, k_values))
-
-average_mismatches, exact_match_fractions = zip(*results)
-
-# Plotting the results
-plt.figure(figsize=(10, 5))
-
-# Plotting the mismatch proportions
-plt.plot(k_values, average_mismatches, marker='o', linestyle='-')
-plt.xticks(k_values)
-plt.xlabel('Value of k')
-plt.ylabel('Mismatch Proportion')
-plt.title('Sequence Similarity as a Function of k')
-plt.grid(True)
+# Shared-memory references for the k sweep. The parent writes each reference
+# into a SharedMemory block once; workers attach by name in their initializer
+# and slice it through FastaRecord views instead of receiving a pickled copy
+# with every task, re-reading the FASTA or decoding a private copy.
+# An uncompressed bacterial FASTA is not copied at all: workers map the file
+# and share its pages through the page cache.
+def share_sequence(seq: str) -> shared_memory.SharedMemory:
+    data = seq.encode('ascii')
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    return shm
+
+def share_fasta_records(file_path: str):
+    # Two streaming passes over a (gzipped) FASTA: the first sizes the block,
+    # the second writes each record at its offset, so only one record is held
+    # in memory at a time. Returns the block and its (name, length, offset) records.
+    records, size = [], 0
+    for name, seq in iter_fasta_records(file_path):
+        records.append((name, len(seq), size))
+        size += len(seq)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+    for (_, length, offset), (_, seq) in zip(records, iter_fasta_records(file_path)):
+        shm.buf[offset:offset + length] = seq.encode('ascii')
+    return shm, records
+
+attached_blocks = []
+
+def attach_records(name: str, records: List[Tuple[str, int, int]]) -> List[FastaRecord]:
+    # FastaRecord views of (name, length, offset) records in a shared block.
+    # Slicing a view decodes only that window, so no worker holds a private
+    # copy of the block; the block stays attached for the worker's lifetime.
+    shm = shared_memory.SharedMemory(name=name)
+    attached_blocks.append(shm)
+    return [FastaRecord(shm.buf, record_name, length, offset, length, length + 1) for record_name, length, offset in records]
+
+def init_worker(sequence_block, query_block):
+    global sequence, bacterial_records
+    name, size = sequence_block
+    sequence = attach_records(name, [('reference', size, 0)])[0]
+    if isinstance(query_block, str):
+        bacterial_records = FastaFile(query_block).records
+    else:
+        bacterial_records = attach_records(*query_block)
+
+def sweep_k(k_values: List[int], reference: str, query_path: str, workers: int = 1, seed: Optional[int] = None, cache_dir: Optional[str] = None):
+    sequence_shm = share_sequence(reference)
+    reference_shm = None
+    if query_path.endswith('.gz'):
+        reference_shm, records = share_fasta_records(query_path)
+        query_block = (reference_shm.name, records)
+    else:
+        read_fai(query_path)  # build the .fai once, before the workers start
+        query_block = query_path
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=((sequence_shm.name, len(reference)), query_block)) as executor:
+            # map yields results in k order, each as soon as it and all smaller k are done
+            for k, result in zip(k_values, executor.map(process_k, k_values, repeat(seed), repeat(cache_dir))):
+                print(f"finished k={k}")
+                yield result
+    finally:
+        sequence_shm.close()
+        sequence_shm.unlink()
+        if reference_shm is not None:
+            reference_shm.close()
+            reference_shm.unlink()
 
 # Curve fitting for the plot
 def power_law(x, a, b):
     return a * np.power(x, b)
 
-params, _ = curve_fit(power_law, k_values, average_mismatches)
-a, b = params
-
-# Annotate the plot with the fitted parameters
-annotation_text = f'a={a:.4f}, b={b:.4f}'
-
-x_fit = np.linspace(min(k_values), max(k_values), 1000)
-y_fit = power_law(x_fit, *params)
-plt.plot(x_fit, y_fit, label='Power-law fit', linestyle='--')
-plt.legend()
-
-plt.annotate(f'a={a:.4f}, b={b:.4f}', xy=(0.6, 0.2), xycoords='axes fraction')
-plt.tight_layout()
-plt.savefig("mismatch.png")
-
-# Print the parameters
-print(f"Fitted parameters: a = {a}, b = {b}")
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the spurious alignment model parameters over a sweep of k.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes for the k sweep (0 = all cores)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for k-mer subsampling, for reproducible runs")
+    parser.add_argument("--index-cache", default=None, help="Directory for memory-mapped minimizer/RYmer indexes shared across runs")
+    parser.add_argument("--bacteria", default="refSoilSmall.fa", help="Bacterial reference FASTA (optionally gzipped) queried in the k sweep")
+    parser.add_argument("--reads", default=None, help="Gzipped FASTQ to stream through the RYmer index instead of running the k sweep")
+    parser.add_argument("--k", type=int, default=15, help="k for read mode (w = k + 2)")
+    parser.add_argument("--read-stats", default="read_stats.tsv", help="Per-read output table for read mode")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="Reads per chunk in read mode")
+    parser.add_argument("--max-hits", type=int, default=1000, help="Skip comparing RYmers with more reference positions than this")
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count()
+
+    # Main code for generating the plot
+    sequence = read_fasta("rCRS.fa")
+    if args.reads:
+        run_read_mode(args.reads, sequence, args.k, args.k + 2, args.read_stats, args.chunk_size, args.max_hits, args.index_cache)
+        return
+
+    k_values = list(range(3, 31))
+    results = list(sweep_k(k_values, sequence, args.bacteria, workers=workers, seed=args.seed, cache_dir=args.index_cache))
+
+    average_mismatches, exact_match_fractions = zip(*results)
+
+    # Plotting the results
+    plt.figure(figsize=(10, 5))
+
+    # Plotting the mismatch proportions
+    plt.plot(k_values, average_mismatches, marker='o', linestyle='-')
+    plt.xticks(k_values)
+    plt.xlabel('Value of k')
+    plt.ylabel('Mismatch Proportion')
+    plt.title('Sequence Similarity as a Function of k')
+    plt.grid(True)
+
+    params, _ = curve_fit(power_law, k_values, average_mismatches)
+    a, b = params
+
+    # Annotate the plot with the fitted parameters
+    annotation_text = f'a={a:.4f}, b={b:.4f}'
+
+    x_fit = np.linspace(min(k_values), max(k_values), 1000)
+    y_fit = power_law(x_fit, *params)
+    plt.plot(x_fit, y_fit, label='Power-law fit', linestyle='--')
+    plt.legend()
+
+    plt.annotate(f'a={a:.4f}, b={b:.4f}', xy=(0.6, 0.2), xycoords='axes fraction')
+    plt.tight_layout()
+    plt.savefig("mismatch.png")
+
+    # Print the parameters
+    print(f"Fitted parameters: a = {a}, b = {b}")
+
+if __name__ == "__main__":
+    main()